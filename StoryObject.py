@@ -1,11 +1,28 @@
 import settings
 
 class StoryObject:
-    def __init__(self, description, genre, heroes, mood):
+    def __init__(self, description, genre, heroes, mood, scene_count=None):
         self.description = description
         self.genre = genre
         self.heroes = heroes if isinstance(heroes, list) else [h.strip() for h in heroes.split(';')]
         self.mood = mood
+        self.scene_count = self._clamp_scene_count(scene_count or settings.STORY_SIZES['default'])
+
+    @staticmethod
+    def _clamp_scene_count(scene_count):
+        if not isinstance(scene_count, int) or isinstance(scene_count, bool):
+            return scene_count
+        sizes = [option['value'] for option in settings.STORY_SIZES['options']]
+        return min(max(scene_count, min(sizes)), max(sizes))
+
+    def cache_key(self):
+        return (
+            self.description.strip(),
+            self.genre.strip(),
+            tuple(h.strip() for h in self.heroes if h.strip()),
+            self.mood,
+            self.scene_count
+        )
 
     def validate(self):
         if not self.description.strip():
@@ -14,4 +31,6 @@ class StoryObject:
             return "Жанр не может быть пустым."
         if not self.heroes or not any(h.strip() for h in self.heroes):
             return "Укажите хотя бы одного персонажа."
+        if not isinstance(self.scene_count, int) or isinstance(self.scene_count, bool):
+            return "Количество сцен должно быть целым числом."
         return None
\ No newline at end of file
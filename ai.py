@@ -1,13 +1,22 @@
 import aiohttp
 import json
 import re
+import time
 
-from config import YANDEX_ID_KEY, YANDEX_API_KEY
 from StoryObject import StoryObject
+from story_document import StoryDocument
+from key_pool import RateLimitError, get_key_pool, parse_retry_after
+from dedup import get_deduplicator
+from model_router import get_model_router
+import timing
 
-def clean_json_response(text: str) -> str:
-    text = re.sub(r'^```(?:json)?\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\s*```$', '', text, flags=re.MULTILINE)
+COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+RATE_LIMIT_RETRIES = 3
+DEDUP_MAX_ATTEMPTS = 3
+
+def repair_json_response(text: str) -> tuple[str, int]:
+    text, opening_fences = re.subn(r'^```(?:json)?\s*', '', text, flags=re.MULTILINE)
+    text, closing_fences = re.subn(r'\s*```$', '', text, flags=re.MULTILINE)
     text = text.strip()
     
     start = text.find('[')
@@ -18,9 +27,15 @@ def clean_json_response(text: str) -> str:
         
     content = text[start+1:end].strip()
     
-    fixed_content = re.sub(r'\}\s*\{', '}, {', content, flags=re.DOTALL)
+    fixed_content, missing_commas = re.subn(r'\}\s*\{', '}, {', content, flags=re.DOTALL)
+
+    repairs = opening_fences + closing_fences + missing_commas + (start > 0) + (end < len(text) - 1)
+    timing.count('repairs', repairs)
     
-    return f"[{fixed_content}]"
+    return f"[{fixed_content}]", repairs
+
+def clean_json_response(text: str) -> str:
+    return repair_json_response(text)[0]
 
 def convert_ai_array_to_graph_format(scene_list: list[dict], story_object: StoryObject) -> dict:
     if not scene_list:
@@ -64,81 +79,320 @@ def convert_ai_array_to_graph_format(scene_list: list[dict], story_object: Story
     }
 
 async def get_story_from_ai(story_object: StoryObject) -> dict:
-    if not YANDEX_API_KEY or not YANDEX_ID_KEY:
-        raise ValueError("YANDEX_API_KEY и YANDEX_ID_KEY должны быть установлены в .env файле.")
-
-    prompt = {
-        "modelUri": f"gpt://{YANDEX_ID_KEY}/yandexgpt-lite",
-        "completionOptions": {
-            "stream": False,
-            "temperature": 0.75,
-            "maxTokens": "16000"
+    messages = [
+        {
+            "role": "system",
+            "text": """Ты — профессиональный сценарист для RPG.
+            Твоя задача — сгенерировать ЕДИНЫЙ JSON-МАССИВ, где каждый элемент — это одна сцена квеста.
+            
+            КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
+            1.  **ФОРМАТ ВЫВОДА**: Верни ТОЛЬКО валидный JSON-массив `[ ... ]`. Без комментариев и markdown.
+            2.  **СТРУКТУРА ОБЪЕКТА**: Каждый объект в массиве должен иметь СТРОГУЮ структуру:
+                {
+                  "scene_id": "1",  
+                  "text": "Полное, насыщенное описание сцены (80-150 слов).",
+                  "choices": [
+                    {"text": "Краткое описание выбора (2-5 слов)", "next_scene": "2"}
+                  ]
+                }
+            3.  **ЗАПЯТЫЕ**: Между КАЖДЫМ объектом в массиве (например, между `}` и `{`) ДОЛЖНА стоять запятая.
+            4.  **ID СЦЕН**: scene_id должны быть последовательными числами от 1 до N в виде строк ("1", "2", "3" и т.д.)
+            5.  **КОНЦОВКИ**: Создай минимум две концовки (сцены без choices)
+            6.  **ВЕТВЛЕНИЕ**: Создай ветвление сюжета с уникальными путями
+            
+            ТРЕБОВАНИЯ К КОНТЕНТУ:
+            -   **Жанр**: Строго Ролевая игра (RPG).
+            -   **Язык**: Русский.
+            -   **Количество сцен**: указано в запросе.
+            """
         },
-        "messages": [
-            {
-                "role": "system",
-                "text": """Ты — профессиональный сценарист для RPG.
-                Твоя задача — сгенерировать ЕДИНЫЙ JSON-МАССИВ, где каждый элемент — это одна сцена квеста.
-                
-                КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
-                1.  **ФОРМАТ ВЫВОДА**: Верни ТОЛЬКО валидный JSON-массив `[ ... ]`. Без комментариев и markdown.
-                2.  **СТРУКТУРА ОБЪЕКТА**: Каждый объект в массиве должен иметь СТРОГУЮ структуру:
-                    {
-                      "scene_id": "1",  
-                      "text": "Полное, насыщенное описание сцены (80-150 слов).",
-                      "choices": [
-                        {"text": "Краткое описание выбора (2-5 слов)", "next_scene": "2"}
-                      ]
-                    }
-                3.  **ЗАПЯТЫЕ**: Между КАЖДЫМ объектом в массиве (например, между `}` и `{`) ДОЛЖНА стоять запятая.
-                4.  **ID СЦЕН**: scene_id должны быть последовательными числами от 1 до N в виде строк ("1", "2", "3" и т.д.)
-                5.  **КОНЦОВКИ**: Создай минимум две концовки (сцены без choices)
-                6.  **ВЕТВЛЕНИЕ**: Создай ветвление сюжета с уникальными путями
-                
-                ТРЕБОВАНИЯ К КОНТЕНТУ:
-                -   **Жанр**: Строго Ролевая игра (RPG).
-                -   **Язык**: Русский.
-                -   **Количество сцен**: От 6 до 12.
-                """
-            },
-            {
-                "role": "user",
-                "text": f"""Создай RPG квест по параметрам:
-                - **Описание**: {story_object.description}
-                - **Жанр**: {story_object.genre}
-                - **Персонажи**: {', '.join(story_object.heroes)}
-                - **Настроение**: {story_object.mood}
-                """
-            }
-        ]
-    }
+        {
+            "role": "user",
+            "text": f"""Создай RPG квест по параметрам:
+            - **Описание**: {story_object.description}
+            - **Жанр**: {story_object.genre}
+            - **Персонажи**: {', '.join(story_object.heroes)}
+            - **Настроение**: {story_object.mood}
+            - **Количество сцен**: от {story_object.scene_count // 2} до {story_object.scene_count}
+            """
+        }
+    ]
 
-    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {YANDEX_API_KEY}"
-    }
+    scene_list = await _request_scene_list(messages, story_object.scene_count)
+    with timing.span('convert'):
+        return convert_ai_array_to_graph_format(scene_list, story_object)
+
+async def get_unique_story_from_ai(story_object: StoryObject, reject: bool = False,
+                                   deduplicator=None, key=None) -> tuple[dict, dict]:
+    if deduplicator is None:
+        deduplicator = get_deduplicator()
+    for _ in range(DEDUP_MAX_ATTEMPTS):
+        story_data = await get_story_from_ai(story_object)
+        with timing.span('dedup'):
+            document = StoryDocument.from_dict(story_data)
+            report = deduplicator.check(document)
+        if not report['duplicates']:
+            break
+        timing.count('near_duplicates')
+        if not reject:
+            break
+    else:
+        raise ValueError("AI несколько раз подряд вернул историю, почти совпадающую с уже сгенерированными.")
+
+    deduplicator.add(document, key)
+    return story_data, report
+
+def _timing_trace_config() -> aiohttp.TraceConfig:
+    async def on_connection_create_start(session, context, params):
+        context.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        timing.record('http.connect', time.perf_counter() - context.connect_started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+async def _request_scene_list(messages: list[dict], scene_count: int = None) -> list[dict]:
+    key_pool = get_key_pool()
+    if not key_pool:
+        raise ValueError("YANDEX_API_KEY и YANDEX_ID_KEY должны быть установлены в .env файле.")
+
+    trace_configs = [_timing_trace_config()] if timing.ENABLED else None
+    router = get_model_router()
+    model = router.choose(scene_count)
+    outcome = latency = None
+    truncated = False
+    repairs = 0
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=prompt, timeout=120) as response:
-                response.raise_for_status()
-                raw_response = await response.text()
-                
+        async with aiohttp.ClientSession(trace_configs=trace_configs) as session:
+            raw_response = None
+            retry_after = None
+            for _ in range(RATE_LIMIT_RETRIES * len(key_pool)):
+                credential = await key_pool.acquire()
+                prompt = {
+                    "modelUri": model['uri'].format(folder_id=credential.folder_id),
+                    "completionOptions": {"stream": False, **model['options']},
+                    "messages": messages
+                }
+                headers = {
+                    "Content-Type": "application/json",
+                    "Authorization": f"Api-Key {credential.api_key}"
+                }
+
+                succeeded = rate_limited = False
+                retry_after = None
                 try:
-                    result_data = json.loads(raw_response)
-                    generated_text = result_data["result"]["alternatives"][0]["message"]["text"]
-                except (json.JSONDecodeError, KeyError):
-                    generated_text = raw_response
+                    request_started = time.perf_counter()
+                    async with session.post(COMPLETION_URL, headers=headers, json=prompt, timeout=120) as response:
+                        timing.record('http.first_byte', time.perf_counter() - request_started)
+                        if response.status == 429:
+                            rate_limited = True
+                            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                            timing.count('rate_limited')
+                            continue
+                        response.raise_for_status()
+                        raw_response = await response.text()
+                        latency = time.perf_counter() - request_started
+                        timing.record('http.complete', latency)
+                        succeeded = True
+                        break
+                finally:
+                    key_pool.release(credential, succeeded, rate_limited, retry_after)
 
-                cleaned_json_text = clean_json_response(generated_text)
-                scene_list = json.loads(cleaned_json_text)
+            if raw_response is None:
+                raise RateLimitError("Превышен лимит запросов к AI для всех ключей. Попробуйте позже.", retry_after)
                 
-                return convert_ai_array_to_graph_format(scene_list, story_object)
+        with timing.span('parse'):
+            try:
+                result_data = json.loads(raw_response)
+                alternative = result_data["result"]["alternatives"][0]
+                generated_text = alternative["message"]["text"]
+                truncated = 'TRUNCATED' in alternative.get("status", "")
+                if timing.ENABLED:
+                    timing.count('tokens', int(result_data["result"].get("usage", {}).get("totalTokens", 0)))
+            except (json.JSONDecodeError, KeyError):
+                generated_text = raw_response
+                repairs = 1
+                timing.count('repairs')
+
+            cleaned_json_text, fixes = repair_json_response(generated_text)
+            repairs += fixes
+            scene_list = json.loads(cleaned_json_text)
+
+        outcome = 'truncated' if truncated else 'repaired' if repairs else 'ok'
+        if timing.ENABLED:
+            timing.count('bytes', len(raw_response.encode('utf-8')))
+            timing.count('scenes', len(scene_list))
+        return scene_list
 
+    except RateLimitError:
+        raise
     except aiohttp.ClientError as e:
+        if isinstance(e, aiohttp.ClientResponseError) and e.status >= 500:
+            outcome = 'failed'
         raise ConnectionError(f"Ошибка сети при обращении к AI: {e}")
     except json.JSONDecodeError as e:
+        outcome = 'truncated' if truncated else 'failed'
         raise ValueError(f"AI вернул некорректный JSON, который не удалось исправить. Ошибка: {e}")
     except Exception as e:
-        raise RuntimeError(f"Неожиданная ошибка при работе с AI: {e}")
\ No newline at end of file
+        raise RuntimeError(f"Неожиданная ошибка при работе с AI: {e}")
+    finally:
+        if outcome is not None:
+            router.record(model, scene_count, outcome, latency)
+
+def find_subtree(document: StoryDocument, scene_id: str) -> set[str]:
+    kept = set()
+    if document.start_scene in document and document.start_scene != scene_id:
+        stack = [document.start_scene]
+        while stack:
+            current = stack.pop()
+            if current in kept or current == scene_id:
+                continue
+            kept.add(current)
+            stack.extend(document.successors(current))
+
+    subtree = set()
+    stack = list(document.successors(scene_id))
+    while stack:
+        current = stack.pop()
+        if current in subtree or current in kept or current == scene_id:
+            continue
+        subtree.add(current)
+        stack.extend(document.successors(current))
+    return subtree
+
+def _path_to_scene(document: StoryDocument, scene_id: str) -> list[tuple[str, str]]:
+    if document.start_scene not in document:
+        return []
+
+    parents = {document.start_scene: None}
+    queue = [document.start_scene]; head = 0
+    while head < len(queue) and scene_id not in parents:
+        current = queue[head]; head += 1
+        for choice in document.scene(current).choices:
+            if choice.next_scene in document and choice.next_scene not in parents:
+                parents[choice.next_scene] = (current, choice.label)
+                queue.append(choice.next_scene)
+
+    if scene_id not in parents:
+        return []
+
+    path = []
+    current, choice_text = scene_id, None
+    while current is not None:
+        path.append((current, choice_text))
+        link = parents[current]
+        current, choice_text = link if link else (None, None)
+    path.reverse()
+    return path
+
+def build_subtree_messages(document: StoryDocument, scene_id: str, story_object: StoryObject) -> list[dict]:
+    subtree = find_subtree(document, scene_id)
+
+    path_lines = []
+    for path_scene_id, choice_text in _path_to_scene(document, scene_id):
+        path_lines.append(f"Сцена {path_scene_id}: {document.scene_text(path_scene_id)}")
+        if choice_text:
+            path_lines.append(f"  Выбор: {choice_text}")
+
+    skeleton_lines = []
+    for scene in document.scenes:
+        if scene.scene_id in subtree or scene.scene_id == scene_id:
+            continue
+        links = ', '.join(f"{c.label} -> old-{c.next_scene}" for c in scene.choices)
+        skeleton_lines.append(f"old-{scene.scene_id}: {links or 'концовка'}")
+
+    return [
+        {
+            "role": "system",
+            "text": """Ты — профессиональный сценарист для RPG.
+            Ты переписываешь одну ветку уже существующего квеста.
+            Верни ТОЛЬКО валидный JSON-массив `[ ... ]` сцен в формате
+            {"scene_id": "1", "text": "...", "choices": [{"text": "...", "next_scene": "2"}]}.
+
+            ПРАВИЛА:
+            1.  Первая сцена массива (scene_id "1") — это текущая сцена. Повтори её текст и придумай для неё НОВЫЕ варианты выбора.
+            2.  Новые сцены нумеруй по порядку: "2", "3" и т.д.
+            3.  Выбор может вести в существующую сцену квеста — тогда укажи её id из схемы, например "old-7".
+            4.  Ветка должна содержать хотя бы одну концовку (сцену без choices).
+            5.  Язык: русский. Количество новых сцен: от 2 до 6.
+            """
+        },
+        {
+            "role": "user",
+            "text": f"""Квест: {document.description or story_object.description}
+            Жанр: {story_object.genre}. Настроение: {story_object.mood}.
+
+            Путь игрока до текущей сцены:
+            {chr(10).join(path_lines)}
+
+            Остальная схема квеста:
+            {chr(10).join(skeleton_lines) or 'нет'}
+
+            Перепиши продолжение, начиная со сцены {scene_id}.
+            """
+        }
+    ]
+
+def splice_subtree(document: StoryDocument, scene_id: str, branch: dict) -> dict:
+    subtree = find_subtree(document, scene_id)
+    kept_scenes = [s for s in document.scenes if s.scene_id not in subtree]
+    kept_ids = {s.scene_id for s in kept_scenes}
+
+    numeric_ids = [int(sid) for sid in document.scene_ids() if sid.isdigit()]
+    next_id = max(numeric_ids, default=len(document)) + 1
+
+    id_map = {}
+    for scene in branch['scenes']:
+        if scene['scene_id'] == branch['start_scene']:
+            id_map[scene['scene_id']] = scene_id
+        else:
+            id_map[scene['scene_id']] = str(next_id)
+            next_id += 1
+
+    def remap(next_scene_id):
+        next_scene_id = str(next_scene_id)
+        if next_scene_id in id_map:
+            return id_map[next_scene_id]
+        if next_scene_id.startswith('old-') and next_scene_id[4:] in kept_ids:
+            return next_scene_id[4:]
+        return None
+
+    new_scenes = {}
+    for scene in branch['scenes']:
+        choices = [{'text': c['text'], 'next_scene': remap(c['next_scene'])} for c in scene['choices']]
+        choices = [c for c in choices if c['next_scene'] is not None]
+        new_scenes[id_map[scene['scene_id']]] = {
+            'scene_id': id_map[scene['scene_id']],
+            'text': scene['text'],
+            'choices': choices,
+            'is_ending': not choices
+        }
+    if not new_scenes[scene_id]['choices']:
+        raise ValueError(f"AI вернул ветку, в которой из сцены {scene_id} нет ни одного корректного перехода.")
+
+    story_data = document.to_dict(resolve_text=True)
+    scenes = []
+    for scene in story_data['scenes']:
+        if scene['scene_id'] in subtree:
+            continue
+        if scene['scene_id'] == scene_id:
+            scene = {**scene, 'choices': new_scenes[scene_id]['choices'],
+                     'is_ending': new_scenes[scene_id]['is_ending']}
+        elif any(c.get('next_scene') in subtree for c in scene.get('choices', [])):
+            choices = [c for c in scene['choices'] if c.get('next_scene') not in subtree]
+            scene = {**scene, 'choices': choices, 'is_ending': not choices}
+        scenes.append(scene)
+    scenes.extend(s for sid, s in new_scenes.items() if sid != scene_id)
+
+    return {**story_data, 'scenes': scenes}
+
+async def regenerate_subtree(document: StoryDocument, scene_id: str, story_object: StoryObject) -> dict:
+    messages = build_subtree_messages(document, scene_id, story_object)
+    scene_list = await _request_scene_list(messages, len(find_subtree(document, scene_id)))
+    with timing.span('convert'):
+        branch = convert_ai_array_to_graph_format(scene_list, story_object)
+    return splice_subtree(document, scene_id, branch)
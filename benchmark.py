@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import synthetic_stories
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+_app = None
+
+def measure(fn, repeat=5, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def _text_words(size):
+    return (80, 150) if size <= 1000 else (10, 20)
+
+def bench_parsing(size, repeat):
+    import ai
+    from StoryObject import StoryObject
+
+    story = synthetic_stories.generate_story(size, branching=3, cycle_rate=0.05, islands=size // 50,
+                                             text_words=_text_words(size), seed=size)
+    raw = synthetic_stories.generate_ai_response(story, 'missing_commas')
+    fenced = f"```json\n{raw}\n```"
+    cleaned = ai.clean_json_response(fenced)
+    scene_list = json.loads(cleaned)
+    story_object = StoryObject(story['description'], 'RPG', 'Герой', 'neutral')
+
+    return {
+        'clean_json_response': measure(lambda: ai.clean_json_response(fenced), repeat),
+        'json.loads': measure(lambda: json.loads(cleaned), repeat),
+        'convert_ai_array_to_graph_format': measure(
+            lambda: ai.convert_ai_array_to_graph_format(scene_list, story_object), repeat)
+    }
+
+def bench_loading(size, repeat):
+    from story_loader import open_story
+
+    story = synthetic_stories.generate_story(size, branching=3, cycle_rate=0.05, seed=size)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'story.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(story, f, ensure_ascii=False, indent=4)
+
+        def load_json():
+            with open(path, encoding='utf-8') as f:
+                json.load(f)
+
+        def load_lazy():
+            story_file, _ = open_story(path)
+            story_file.close()
+
+        return {
+            'load.json.load': measure(load_json, repeat),
+            'load.open_story': measure(load_lazy, repeat)
+        }
+
+def bench_dedup(size, repeat):
+    from dedup import StoryDeduplicator
+
+    corpus = synthetic_stories.generate_corpus(max(1, size // 100), num_scenes=min(size, 100), branching=3,
+                                               cycle_rate=0.05, seed=size)
+    probe = synthetic_stories.generate_story(min(size, 100), branching=3, seed=size + 1)
+    probe['scenes'][0]['text'] = '* * * * * * * * * * * *\n' + probe['scenes'][0]['text']
+    state = {}
+
+    def setup():
+        state['index'] = StoryDeduplicator()
+
+    indexed = StoryDeduplicator()
+    indexed.add_many(corpus)
+    return {
+        'StoryDeduplicator.add_many': measure(lambda: state['index'].add_many(corpus), repeat, setup=setup),
+        'StoryDeduplicator.check': measure(lambda: indexed.check(probe), repeat)
+    }
+
+def _walk_json(index, start, rolls):
+    scene = index[start]
+    for roll in rolls:
+        choices = scene['choices']
+        scene = index[choices[int(roll * len(choices))]['next_scene']] if choices else index[start]
+
+def _walk_runtime(runtime, rolls):
+    for roll in rolls:
+        count = runtime.choice_count()
+        if count:
+            runtime.choose(int(roll * count))
+        else:
+            runtime.reset()
+
+def bench_runtime(size, repeat, steps=10000):
+    from story_compiler import CompiledStory, StoryRuntime, write_compiled
+
+    story = synthetic_stories.generate_story(size, branching=3, cycle_rate=0.05, text_words=_text_words(size),
+                                             seed=size)
+    rng = random.Random(size)
+    rolls = [rng.random() for _ in range(steps)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'story.json')
+        compiled_path = os.path.join(directory, 'story.qsb')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(story, f, ensure_ascii=False)
+        write_compiled(story, compiled_path)
+
+        def load_json():
+            with open(json_path, encoding='utf-8') as f:
+                data = json.load(f)
+            return {scene['scene_id']: scene for scene in data['scenes']}
+
+        def load_compiled():
+            story = CompiledStory.load(compiled_path)
+            StoryRuntime(story)
+            story.close()
+
+        index = load_json()
+        compiled = CompiledStory.load(compiled_path)
+        runtime = StoryRuntime(compiled)
+        results = {
+            'runtime.load (json)': measure(load_json, repeat),
+            'runtime.load (compiled)': measure(load_compiled, repeat),
+            'runtime.1000 steps (json)': measure(lambda: _walk_json(index, story['start_scene'], rolls),
+                                                 repeat) * 1000 / steps,
+            'runtime.1000 steps (compiled)': measure(lambda: _walk_runtime(runtime, rolls),
+                                                      repeat, setup=runtime.reset) * 1000 / steps
+        }
+        compiled.close()
+    return results
+
+def _qt_app():
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication(sys.argv)
+    return _app
+
+def bench_graph(size, repeat):
+    _qt_app()
+    from story_graph import StoryGraph
+
+    story = synthetic_stories.generate_story(size, branching=3, cycle_rate=0.05, islands=size // 50,
+                                             text_words=(5, 10), seed=size)
+    graph = StoryGraph()
+
+    results = {
+        'update_graph': measure(lambda: graph.update_graph(story), repeat,
+                                setup=lambda: graph.draw_empty_graph("")),
+        'layout': measure(graph._custom_hierarchical_layout, repeat),
+        'redraw_graph': measure(graph.redraw_graph, repeat)
+    }
+
+    positions = list(graph.node_positions.values())
+    edges = list(graph.G.edges())
+    hover_events = []
+    for u, v in edges[:200]:
+        (x1, y1), (x2, y2) = graph.node_positions[u], graph.node_positions[v]
+        hover_events.append(SimpleNamespace(inaxes=graph.ax, xdata=(x1 + x2) / 2, ydata=(y1 + y2) / 2))
+        hover_events.append(SimpleNamespace(inaxes=graph.ax, xdata=x1 + 0.7, ydata=y1 + 0.7))
+    click_events = [SimpleNamespace(inaxes=graph.ax, xdata=x, ydata=y) for x, y in positions[:200]]
+
+    def hover_all():
+        for event in hover_events:
+            graph.on_hover(event)
+
+    def click_all():
+        for event in click_events:
+            graph.selected_node = None
+            graph.on_click(event)
+
+    if hover_events:
+        results['on_hover'] = measure(hover_all, repeat) / len(hover_events)
+    if click_events:
+        results['on_click'] = measure(click_all, repeat) / len(click_events)
+
+    graph.close()
+    return results
+
+def _allocated(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+def _peak(build):
+    tracemalloc.start()
+    try:
+        kept = build()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return peak
+
+def _open_all(paths):
+    from story_loader import open_story
+
+    opened = [open_story(path) for path in paths]
+    for story_file, _ in opened:
+        story_file.close()
+    return opened
+
+def _json_load_all(paths):
+    loaded = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            loaded.append(json.load(f))
+    return loaded
+
+def bench_memory(count, size):
+    from story_document import StoryDocument
+    from story_library import StoryLibrary
+
+    corpus = [json.dumps(story, ensure_ascii=False)
+              for story in synthetic_stories.generate_corpus(count, num_scenes=size, branching=3,
+                                                             cycle_rate=0.05, seed=size)]
+    scenes = count * size
+
+    def build_library(compress):
+        library = StoryLibrary(compress=compress)
+        for raw in corpus:
+            library.add(json.loads(raw))
+        return library
+
+    results = {
+        'dict': _allocated(lambda: [json.loads(raw) for raw in corpus]) / scenes,
+        'StoryDocument': _allocated(lambda: [StoryDocument.from_dict(json.loads(raw)) for raw in corpus]) / scenes,
+        'StoryLibrary': _allocated(lambda: build_library(False)) / scenes,
+        'StoryLibrary (zlib)': _allocated(lambda: build_library(True)) / scenes
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, raw in enumerate(corpus):
+            paths.append(os.path.join(directory, f'story_{i}.json'))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(raw)
+        results['json.load (пик)'] = _peak(lambda: _json_load_all(paths)) / scenes
+        results['open_story (пик)'] = _peak(lambda: _open_all(paths)) / scenes
+    return results
+
+def print_memory(results):
+    base = results['dict']
+    print(f"{'хранилище':<24}{'байт на сцену':>16}{'доля':>10}")
+    for name, per_scene in results.items():
+        print(f"{name:<24}{per_scene:>16.0f}{per_scene / base:>10.2f}")
+
+def run(sizes, repeat, max_render):
+    results = {}
+    for size in sizes:
+        print(f"-- {size} сцен", file=sys.stderr)
+        for name, seconds in bench_parsing(size, repeat).items():
+            results.setdefault(name, {})[str(size)] = seconds
+        for name, seconds in bench_loading(size, repeat).items():
+            results.setdefault(name, {})[str(size)] = seconds
+        for name, seconds in bench_dedup(size, repeat).items():
+            results.setdefault(name, {})[str(size)] = seconds
+        for name, seconds in bench_runtime(size, repeat).items():
+            results.setdefault(name, {})[str(size)] = seconds
+        if size <= max_render:
+            for name, seconds in bench_graph(size, repeat).items():
+                results.setdefault(name, {})[str(size)] = seconds
+    return results
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, by_size in results.items():
+        for size, seconds in by_size.items():
+            base = baseline.get(name, {}).get(size)
+            if not base:
+                continue
+            ratio = seconds / base
+            if ratio > threshold:
+                regressions.append((name, size, base, seconds, ratio))
+    return regressions
+
+def print_table(results, baseline=None):
+    sizes = sorted({size for by_size in results.values() for size in by_size}, key=int)
+    print(f"{'бенчмарк':<36}" + ''.join(f"{size:>20}" for size in sizes))
+    for name, by_size in results.items():
+        cells = []
+        for size in sizes:
+            if size not in by_size:
+                cells.append(f"{'-':>20}")
+                continue
+            cell = f"{by_size[size] * 1000:.3f}мс"
+            base = (baseline or {}).get(name, {}).get(size)
+            if base:
+                cell += f" ×{by_size[size] / base:.2f}"
+            cells.append(f"{cell:>20}")
+        print(f"{name:<36}" + ''.join(cells))
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки конвейера генерации и отрисовки")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-render', type=int, default=2000,
+                        help="максимальный размер истории для бенчмарков отрисовки")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="допустимое замедление относительно базовой линии")
+    parser.add_argument('--memory', action='store_true',
+                        help="измерить расход памяти на сцену вместо времени")
+    parser.add_argument('--stories', type=int, default=200,
+                        help="количество историй в корпусе для --memory")
+    args = parser.parse_args()
+
+    if args.memory:
+        for size in args.sizes:
+            print(f"-- {args.stories} историй по {size} сцен", file=sys.stderr)
+            print_memory(bench_memory(args.stories, size))
+        return
+
+    results = run(args.sizes, args.repeat, args.max_render)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Базовая линия сохранена в {args.baseline}")
+    elif baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, size, base, seconds, ratio in regressions:
+            print(f"РЕГРЕССИЯ {name} [{size}]: {base * 1000:.3f}мс -> {seconds * 1000:.3f}мс (×{ratio:.2f})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
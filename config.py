@@ -3,4 +3,33 @@ from dotenv import load_dotenv
 
 load_dotenv()
 YANDEX_ID_KEY = os.getenv("YANDEX_ID_KEY")
-YANDEX_API_KEY = os.getenv("YANDEX_API_KEY")
\ No newline at end of file
+YANDEX_API_KEY = os.getenv("YANDEX_API_KEY")
+
+def _split_env(name):
+    return [value.strip() for value in os.getenv(name, "").split(",") if value.strip()]
+
+def _load_credentials():
+    api_keys = _split_env("YANDEX_API_KEYS")
+    folder_ids = _split_env("YANDEX_ID_KEYS")
+    if len(folder_ids) == 1:
+        folder_ids = folder_ids * len(api_keys)
+    if len(folder_ids) != len(api_keys):
+        raise ValueError(f"Число ключей в YANDEX_API_KEYS ({len(api_keys)}) не совпадает с числом id каталогов "
+                         f"в YANDEX_ID_KEYS ({len(folder_ids)}): укажите по одному id на ключ или один id для всех.")
+    credentials = list(zip(api_keys, folder_ids))
+    if YANDEX_API_KEY and YANDEX_ID_KEY and (YANDEX_API_KEY, YANDEX_ID_KEY) not in credentials:
+        credentials.insert(0, (YANDEX_API_KEY, YANDEX_ID_KEY))
+    return credentials
+
+YANDEX_CREDENTIALS = _load_credentials()
+YANDEX_KEY_RPS = float(os.getenv("YANDEX_KEY_RPS", "1"))
+YANDEX_KEY_BURST = int(os.getenv("YANDEX_KEY_BURST", "3"))
+YANDEX_KEY_MAX_CONCURRENCY = int(os.getenv("YANDEX_KEY_MAX_CONCURRENCY", "8"))
+
+STORY_DEDUP = os.getenv("STORY_DEDUP", "off")
+STORY_DEDUP_THRESHOLD = float(os.getenv("STORY_DEDUP_THRESHOLD", "0.8"))
+
+MODEL_STATS_PATH = os.getenv("MODEL_STATS_PATH")
+
+TIMING_LOG = os.getenv("STORY_TIMING_LOG")
+TIMING_ENABLED = bool(TIMING_LOG) or os.getenv("STORY_TIMING") == "1"
\ No newline at end of file
@@ -0,0 +1,312 @@
+import threading
+import zlib
+from collections import deque
+from itertools import chain
+
+import numpy as np
+
+from config import STORY_DEDUP_THRESHOLD
+from story_document import StoryDocument
+
+_BATCH_TOKENS = 1 << 22
+_EMPTY = np.iinfo(np.uint32).max
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def _word_mask(codepoints):
+    return (((codepoints >= 0x30) & (codepoints <= 0x39)) |
+            ((codepoints >= 0x61) & (codepoints <= 0x7A)) |
+            ((codepoints >= 0xC0) & ((codepoints < 0x2000) | (codepoints >= 0x2070)) &
+             (codepoints != 0xD7) & (codepoints != 0xF7)))
+
+
+def _fmix(values):
+    values ^= values >> np.uint32(16)
+    values *= np.uint32(0x85EBCA6B)
+    values ^= values >> np.uint32(13)
+    values *= np.uint32(0xC2B2AE35)
+    values ^= values >> np.uint32(16)
+    return values
+
+
+class MinHashIndex:
+    def __init__(self, num_perm=128, bands=16, shingle=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("Количество перестановок должно делиться на количество полос.")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 1 << 32, num_perm, dtype=np.uint32) | np.uint32(1)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint32)
+        self.mix = rng.integers(0, 1 << 32, shingle, dtype=np.uint32) | np.uint32(1)
+
+        self.keys = []
+        self._signatures = np.empty((64, num_perm), dtype=np.uint32)
+        self.runs = []
+        self._vocabulary = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def signatures(self):
+        return self._signatures[:len(self.keys)]
+
+    def _text_tokens(self, texts):
+        texts = [text.lower() for text in texts]
+        boundaries = np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) + 1)
+        codepoints = np.frombuffer(' '.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+        in_word = _word_mask(codepoints)
+        starts = np.flatnonzero(in_word[1:] & ~in_word[:-1]) + 1
+        if len(in_word) and in_word[0]:
+            starts = np.r_[0, starts]
+        if not len(starts):
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+        owners = np.searchsorted(boundaries, starts, side='right')
+
+        word_starts = np.zeros(len(codepoints), dtype=np.int32)
+        word_starts[starts] = starts
+        positions = np.arange(len(codepoints), dtype=np.int32) - np.maximum.accumulate(word_starts)
+        positions[~in_word] = 0
+        powers = np.full(int(np.diff(np.r_[starts, len(codepoints)]).max()), 0x01000193, dtype=np.uint32)
+        powers[0] = 1
+        powers = np.multiply.accumulate(powers)
+
+        chars = codepoints * powers[positions] * in_word
+        return _fmix(np.add.reduceat(chars, starts, dtype=np.uint32)), owners
+
+    def _list_tokens(self, token_lists):
+        lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+        tokens = list(chain.from_iterable(token_lists))
+        vocabulary = self._vocabulary
+        for token in set(tokens).difference(vocabulary):
+            vocabulary[token] = zlib.crc32(token.encode('utf-8'))
+        hashes = np.fromiter(map(vocabulary.__getitem__, tokens), dtype=np.uint32, count=len(tokens))
+        return hashes, np.repeat(np.arange(len(token_lists)), lengths)
+
+    def _shingles(self, hashes, owners):
+        k = self.shingle
+        count = len(hashes) - k + 1
+        if count <= 0:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+
+        shingles = np.zeros(count, dtype=np.uint32)
+        for offset in range(k):
+            shingles *= np.uint32(0x01000193)
+            shingles += hashes[offset:offset + count] * self.mix[offset]
+        valid = owners[:count] == owners[k - 1:]
+        return shingles[valid], owners[:count][valid]
+
+    def _minhash(self, shingles, owners, out):
+        groups = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        rows = owners[groups]
+        hashed = np.empty_like(shingles)
+        shifted = np.empty_like(shingles)
+        for i in range(self.num_perm):
+            np.multiply(shingles, self.a[i], out=hashed)
+            np.right_shift(hashed, 15, out=shifted)
+            np.bitwise_xor(hashed, shifted, out=hashed)
+            np.add(hashed, self.b[i], out=hashed)
+            out[rows, i] = np.minimum.reduceat(hashed, groups)
+
+    def signatures_for(self, texts=None, token_lists=None):
+        items = texts if token_lists is None else token_lists
+        result = np.full((len(items), self.num_perm), _EMPTY, dtype=np.uint32)
+
+        start = 0
+        while start < len(items):
+            end, size = start, 0
+            while end < len(items) and (end == start or size < _BATCH_TOKENS):
+                size += len(items[end]) if token_lists is not None else len(items[end]) // 6 + 1
+                end += 1
+            if token_lists is None:
+                hashes, owners = self._text_tokens(items[start:end])
+            else:
+                hashes, owners = self._list_tokens(items[start:end])
+            shingles, owners = self._shingles(hashes, owners)
+            if len(shingles):
+                self._minhash(shingles, owners, result[start:end])
+            start = end
+        return result
+
+    def _band_keys(self, signatures):
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+        for row in range(self.rows):
+            keys *= np.uint64(0x100000001B3)
+            keys ^= bands[:, :, row]
+        return keys.T
+
+    def _add_run(self, band_keys, items):
+        order = np.argsort(band_keys, axis=1, kind='stable')
+        self.runs.append((np.take_along_axis(band_keys, order, axis=1), items[order]))
+        while len(self.runs) > 1 and 2 * self.runs[-1][0].shape[1] >= self.runs[-2][0].shape[1]:
+            (keys_a, items_a), (keys_b, items_b) = self.runs.pop(-2), self.runs.pop()
+            keys, items = np.hstack([keys_a, keys_b]), np.hstack([items_a, items_b])
+            order = np.argsort(keys, axis=1, kind='stable')
+            self.runs.append((np.take_along_axis(keys, order, axis=1), np.take_along_axis(items, order, axis=1)))
+
+    def add_many(self, keys, texts=None, token_lists=None):
+        signatures = self.signatures_for(texts, token_lists)
+        keep = ~(signatures == _EMPTY).all(axis=1)
+        signatures = signatures[keep]
+        keys = [key for key, kept in zip(keys, keep) if kept]
+        if not keys:
+            return 0
+
+        offset = len(self.keys)
+        needed = offset + len(keys)
+        if needed > len(self._signatures):
+            grown = np.empty((max(needed, 2 * len(self._signatures)), self.num_perm), dtype=np.uint32)
+            grown[:offset] = self._signatures[:offset]
+            self._signatures = grown
+        self._signatures[offset:needed] = signatures
+        self.keys.extend(keys)
+
+        self._add_run(self._band_keys(signatures), np.arange(offset, needed))
+        return len(keys)
+
+    def query_many(self, signatures, threshold=0.8):
+        results = [[] for _ in range(len(signatures))]
+        if not self.keys or not len(signatures):
+            return results
+
+        band_keys = self._band_keys(signatures)
+        queries, candidates = [], []
+        for keys, items in self.runs:
+            for band in range(self.bands):
+                low = np.searchsorted(keys[band], band_keys[band], side='left')
+                high = np.searchsorted(keys[band], band_keys[band], side='right')
+                counts = high - low
+                if not counts.any():
+                    continue
+                positions = np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                queries.append(np.repeat(np.arange(len(signatures)), counts))
+                candidates.append(items[band][positions])
+        if not queries:
+            return results
+
+        pairs = np.unique(np.stack([np.concatenate(queries), np.concatenate(candidates)]), axis=1)
+        query_ids, item_ids = pairs
+        similarity = (self.signatures[item_ids] == signatures[query_ids]).mean(axis=1)
+        keep = (similarity >= threshold) & ~(signatures[query_ids] == _EMPTY).all(axis=1)
+        query_ids, item_ids, similarity = query_ids[keep], item_ids[keep], similarity[keep]
+
+        for i in np.lexsort((-similarity, query_ids)):
+            results[query_ids[i]].append((self.keys[item_ids[i]], float(similarity[i])))
+        return results
+
+    def query_signature(self, signature, threshold=0.8):
+        return self.query_many(signature[None], threshold)[0]
+
+    def query(self, text, threshold=0.8):
+        return self.query_signature(self.signatures_for([text])[0], threshold)
+
+
+def story_skeleton(document):
+    depth = {document.start_scene: 0} if document.start_scene in document else {}
+    queue = deque(depth)
+    order = []
+    while queue:
+        scene_id = queue.popleft()
+        order.append(scene_id)
+        for target in document.successors(scene_id):
+            if target not in depth:
+                depth[target] = depth[scene_id] + 1
+                queue.append(target)
+
+    tokens = []
+    for scene_id in order:
+        scene = document.scene(scene_id)
+        tokens.append(f"{depth[scene_id]}:{len(scene.choices)}")
+        for choice in scene.choices:
+            target_depth = depth.get(choice.next_scene)
+            move = 'x' if target_depth is None else target_depth - depth[scene_id]
+            tokens.append(f"{move}:{choice.label.lower()}")
+    return tokens
+
+
+class StoryDeduplicator:
+    def __init__(self, threshold=0.8, scene_ratio=0.5, skeleton_threshold=0.9, num_perm=128, bands=16, seed=1):
+        self.threshold = threshold
+        self.scene_ratio = scene_ratio
+        self.skeleton_threshold = skeleton_threshold
+        self.scenes = MinHashIndex(num_perm, bands, shingle=3, seed=seed)
+        self.skeletons = MinHashIndex(num_perm, bands, shingle=2, seed=seed)
+        self._next_key = 0
+
+    def __len__(self):
+        return len(self.skeletons)
+
+    def _prepare(self, story):
+        document = story if isinstance(story, StoryDocument) else StoryDocument.from_dict(story)
+        scene_ids = document.scene_ids()
+        texts = [document.scene_text(scene_id) for scene_id in scene_ids]
+        return document, scene_ids, texts
+
+    def add(self, story, key=None):
+        if key is None:
+            key = self._next_key
+        self._next_key += 1
+        document, scene_ids, texts = self._prepare(story)
+        self.scenes.add_many([(key, scene_id) for scene_id in scene_ids], texts)
+        self.skeletons.add_many([key], token_lists=[story_skeleton(document)])
+        return key
+
+    def add_many(self, stories, keys=None):
+        keys = list(keys) if keys is not None else list(range(self._next_key, self._next_key + len(stories)))
+        self._next_key += len(stories)
+
+        scene_keys, texts, skeletons = [], [], []
+        for key, story in zip(keys, stories):
+            document, scene_ids, story_texts = self._prepare(story)
+            scene_keys.extend((key, scene_id) for scene_id in scene_ids)
+            texts.extend(story_texts)
+            skeletons.append(story_skeleton(document))
+
+        self.scenes.add_many(scene_keys, texts)
+        self.skeletons.add_many(keys, token_lists=skeletons)
+        return keys
+
+    def check(self, story):
+        document, scene_ids, texts = self._prepare(story)
+
+        scene_matches = {}
+        shared_scenes = {}
+        signatures = self.scenes.signatures_for(texts)
+        for scene_id, matches in zip(scene_ids, self.scenes.query_many(signatures, self.threshold)):
+            if matches:
+                scene_matches[scene_id] = matches
+                for story_key in {key for (key, _), _ in matches}:
+                    shared_scenes[story_key] = shared_scenes.get(story_key, 0) + 1
+
+        skeleton_signature = self.skeletons.signatures_for(token_lists=[story_skeleton(document)])[0]
+        skeleton_matches = dict(self.skeletons.query_signature(skeleton_signature, self.skeleton_threshold))
+
+        duplicates = []
+        for story_key in set(shared_scenes) | set(skeleton_matches):
+            ratio = shared_scenes.get(story_key, 0) / max(len(scene_ids), 1)
+            skeleton = skeleton_matches.get(story_key, 0.0)
+            if ratio >= self.scene_ratio or skeleton >= self.skeleton_threshold:
+                duplicates.append({'story': story_key, 'scene_ratio': ratio, 'skeleton_similarity': skeleton})
+        duplicates.sort(key=lambda d: (d['scene_ratio'], d['skeleton_similarity']), reverse=True)
+
+        return {
+            'duplicates': duplicates,
+            'scene_matches': scene_matches,
+            'duplicate_scene_ratio': len(scene_matches) / max(len(scene_ids), 1)
+        }
+
+
+def get_deduplicator():
+    global _deduplicator
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            _deduplicator = StoryDeduplicator(threshold=STORY_DEDUP_THRESHOLD)
+        return _deduplicator
@@ -1,24 +1,34 @@
 from PyQt5.QtWidgets import (
     QWidget, QLabel, QTextEdit, QPushButton, QVBoxLayout, QHBoxLayout,
-    QComboBox, QScrollArea, QFrame, QSizePolicy, QMessageBox, QSplitter
+    QComboBox, QScrollArea, QFrame, QSizePolicy, QMessageBox, QSplitter, QCheckBox
 )
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer
 from PyQt5.QtGui import QFont
 
 from story_graph import StoryGraph
+from story_document import StoryDocument
 import settings
 from gui_style import style
 from StoryObject import StoryObject
+import story_loader
+import story_analysis
+import timing
 
 class MainWindow(QWidget):
     storyRequested = pyqtSignal(StoryObject)
+    subtreeRequested = pyqtSignal(object, str, StoryObject)
+    speculationRequested = pyqtSignal(StoryObject)
+    speculationToggled = pyqtSignal(bool)
 
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Game Story Generator")
         self.setGeometry(100, 100, 1600, 900)
         self.setStyleSheet(style)
-        self.current_story = None
+        self.document = None
+        self.story_file = None
+        self.is_generating = False
+        self.is_regenerating_branch = False
         self.init_ui()
 
     def init_ui(self):
@@ -59,13 +69,27 @@ class MainWindow(QWidget):
         self.heroes_input = self._create_labeled_widget(QTextEdit, "Персонажи (через точку с запятой):", 80)
 
         self.mood_combo = self._create_labeled_combo("Настроение:", settings.MOODS)
+        self.size_combo = self._create_labeled_combo("Размер истории:", settings.STORY_SIZES)
 
         for widget in [self.desc_input, self.genre_input, self.heroes_input,
-                       self.mood_combo]:
+                       self.mood_combo, self.size_combo]:
             left_layout.addWidget(widget)
         
         left_layout.addStretch()
 
+        self.speculative_check = QCheckBox("Готовить историю заранее, пока заполняются поля")
+        self.speculative_check.toggled.connect(self.on_speculation_toggled)
+        left_layout.addWidget(self.speculative_check)
+
+        self.speculation_timer = QTimer(self)
+        self.speculation_timer.setSingleShot(True)
+        self.speculation_timer.setInterval(settings.SPECULATIVE['debounce_ms'])
+        self.speculation_timer.timeout.connect(self.on_inputs_settled)
+        for text_input in [self.desc_input, self.genre_input, self.heroes_input]:
+            text_input.widget.textChanged.connect(self.on_inputs_edited)
+        self.mood_combo.widget.currentIndexChanged.connect(self.on_inputs_edited)
+        self.size_combo.widget.currentIndexChanged.connect(self.on_inputs_edited)
+
         self.generate_btn = QPushButton("Сгенерировать историю", objectName="actionButton")
         self.generate_btn.setMinimumHeight(50)
         self.generate_btn.clicked.connect(self.on_generate_button_clicked)
@@ -89,12 +113,20 @@ class MainWindow(QWidget):
         header_layout.addWidget(self.info_label)
         
         self.graph_canvas = StoryGraph()
+        self.graph_canvas.selectionChanged.connect(self.on_selection_changed)
         
         footer_layout = QHBoxLayout()
         self.export_btn = QPushButton("Экспорт в JSON", objectName="actionButton")
         self.export_btn.setEnabled(False)
         self.export_btn.clicked.connect(self.export_story)
         footer_layout.addWidget(self.export_btn)
+        self.open_btn = QPushButton("Открыть историю", objectName="actionButton")
+        self.open_btn.clicked.connect(self.open_story)
+        footer_layout.addWidget(self.open_btn)
+        self.regenerate_branch_btn = QPushButton("Перегенерировать ветку", objectName="actionButton")
+        self.regenerate_branch_btn.setEnabled(False)
+        self.regenerate_branch_btn.clicked.connect(self.on_regenerate_branch_clicked)
+        footer_layout.addWidget(self.regenerate_branch_btn)
         footer_layout.addStretch()
         self.stats_label = QLabel("Статистика: ожидание...", objectName="statsLabel")
         footer_layout.addWidget(self.stats_label)
@@ -131,56 +163,171 @@ class MainWindow(QWidget):
             
         return container
 
-    def on_generate_button_clicked(self):
-        story_obj = StoryObject(
+    def _story_object_from_form(self):
+        return StoryObject(
             description=self.desc_input.widget.toPlainText(),
             genre=self.genre_input.widget.toPlainText(),
             heroes=[h.strip() for h in self.heroes_input.widget.toPlainText().split(';')],
-            mood=self.mood_combo.widget.currentData()
+            mood=self.mood_combo.widget.currentData(),
+            scene_count=self.size_combo.widget.currentData()
         )
+
+    def on_generate_button_clicked(self):
+        story_obj = self._story_object_from_form()
         
         error_msg = story_obj.validate()
         if error_msg:
             self.show_message("Ошибка валидации", error_msg, QMessageBox.Warning)
             return
 
+        self.speculation_timer.stop()
         self.set_ui_for_generation(True)
         self.storyRequested.emit(story_obj)
 
+    def on_speculation_toggled(self, enabled):
+        self.speculation_timer.stop()
+        self.speculationToggled.emit(enabled)
+        if enabled:
+            self.on_inputs_edited()
+
+    def on_inputs_edited(self):
+        if self.speculative_check.isChecked():
+            self.speculation_timer.start()
+
+    def on_inputs_settled(self):
+        story_obj = self._story_object_from_form()
+        if self.speculative_check.isChecked() and not story_obj.validate():
+            self.speculationRequested.emit(story_obj)
+
+    def on_selection_changed(self, scene_id):
+        self.regenerate_branch_btn.setEnabled(bool(scene_id and self.document is not None and not self.is_generating))
+
+    def on_regenerate_branch_clicked(self):
+        scene_id = self.graph_canvas.selected_node
+        if not scene_id or self.document is None: return
+
+        story_obj = self._story_object_from_form()
+        if not story_obj.description.strip():
+            story_obj.description = self.document.description or ''
+        if not story_obj.genre.strip():
+            story_obj.genre = "RPG"
+
+        self.is_regenerating_branch = True
+        self.set_ui_for_generation(True, clear_graph=False)
+        self.info_label.setText(f"Перегенерация ветки со сцены {scene_id}...")
+        self.subtreeRequested.emit(self.document, scene_id, story_obj)
+
     def set_story_data(self, story_data):
-        self.current_story = story_data
-        self.graph_canvas.update_graph(story_data)
-        self.info_label.setText(f"История сгенерирована.")
-        self.stats_label.setText(self.graph_canvas.get_graph_statistics())
+        self._close_story_file()
+        self.document = StoryDocument.from_dict(story_data)
+        self.graph_canvas.update_graph(self.document)
+        self.info_label.setText("Ветка перегенерирована." if self.is_regenerating_branch else f"История сгенерирована.")
+        self._show_statistics()
         self.export_btn.setEnabled(True)
         self.set_ui_for_generation(False)
 
     def handle_generation_error(self, message):
         self.show_message("Ошибка генерации", message, QMessageBox.Critical)
-        self.graph_canvas.draw_empty_graph(f"Ошибка:\n{message}")
+        if not self.is_regenerating_branch:
+            self.graph_canvas.draw_empty_graph(f"Ошибка:\n{message}")
+            self.stats_label.setText("Статистика: ошибка")
         self.info_label.setText("Произошла ошибка.")
-        self.stats_label.setText("Статистика: ошибка")
+        timing.end()
         self.set_ui_for_generation(False)
 
-    def set_ui_for_generation(self, is_generating):
+    def set_ui_for_generation(self, is_generating, clear_graph=True):
+        self.is_generating = is_generating
+        if not is_generating:
+            self.is_regenerating_branch = False
         self.generate_btn.setEnabled(not is_generating)
+        self.open_btn.setEnabled(not is_generating)
+        self.on_selection_changed(self.graph_canvas.selected_node)
         self.generate_btn.setText("Генерация..." if is_generating else "Сгенерировать историю")
-        if is_generating:
+        if is_generating and clear_graph:
             self.info_label.setText("Идёт генерация, пожалуйста, подождите...")
             self.graph_canvas.draw_empty_graph("Генерация схемы сюжета...")
 
+    def open_story(self):
+        from PyQt5.QtWidgets import QFileDialog
+
+        filename, _ = QFileDialog.getOpenFileName(self, "Открыть историю", "", "JSON (*.json)")
+        if not filename:
+            return
+
+        timing.begin('open')
+        try:
+            with timing.span('parse'):
+                story_file, story_data = story_loader.open_story(filename)
+        except Exception as e:
+            timing.end()
+            self.show_message("Ошибка открытия", f"Не удалось открыть файл: {e}", QMessageBox.Critical)
+            return
+
+        self._close_story_file()
+        self.story_file = story_file
+        self.document = StoryDocument.from_dict(story_data, text_provider=story_file.scene_text)
+        self.graph_canvas.update_graph(self.document)
+        self.info_label.setText("История загружена из файла.")
+        self._show_statistics()
+        self.export_btn.setEnabled(True)
+
+    def _show_statistics(self):
+        stats = self.graph_canvas.get_graph_statistics()
+        analysis_summary, analysis_details = self._analyze_story()
+        if analysis_summary:
+            stats += f" | {analysis_summary}"
+        timing_summary = timing.end()
+        self.stats_label.setText(f"{stats} | {timing_summary}" if timing_summary else stats)
+        self.stats_label.setToolTip(analysis_details)
+
+    def _analyze_story(self):
+        if len(self.document) > settings.ANALYSIS['max_scenes']:
+            return "", f"Анализ концовок отключён для историй больше {settings.ANALYSIS['max_scenes']} сцен."
+        try:
+            analysis = story_analysis.analyze_story(self.document)
+        except Exception:
+            return "", ""
+        if not analysis:
+            return "", ""
+        if analysis['expected_length'] is None:
+            return "Концовки недостижимы", ""
+
+        summary = f"Средняя длина: {analysis['expected_length']:.1f}"
+        if analysis['unfinished'] > 0:
+            summary += f" | Зацикливание: {analysis['unfinished']:.0%}"
+
+        endings = sorted(analysis['ending_probabilities'].items(), key=lambda item: -item[1])
+        details = "Вероятность концовок при случайном выборе:\n" + "\n".join(
+            f"Сцена {scene_id}: {probability:.1%}" for scene_id, probability in endings)
+        if analysis['method'] == 'monte_carlo':
+            details += "\n(оценка методом Монте-Карло)"
+        return summary, details
+
+    def _close_story_file(self):
+        if self.story_file:
+            self.story_file.close()
+            self.story_file = None
+
     def export_story(self):
-        if not self.current_story: return
+        if self.document is None: return
         
         from PyQt5.QtWidgets import QFileDialog
         import json
 
-        filename, _ = QFileDialog.getSaveFileName(self, "Сохранить историю", "story.json", "JSON (*.json)")
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self, "Сохранить историю", "story.json", "JSON (*.json);;Игровой формат (*.qsb)")
         
         if filename:
             try:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(self.current_story, f, ensure_ascii=False, indent=2)
+                if filename.endswith('.qsb') or selected_filter.endswith('(*.qsb)'):
+                    from story_compiler import write_compiled
+                    if not filename.endswith('.qsb'):
+                        filename = filename[:-len('.json')] if filename.endswith('.json') else filename
+                        filename += '.qsb'
+                    write_compiled(self.document, filename)
+                else:
+                    with open(filename, 'w', encoding='utf-8') as f:
+                        json.dump(self.document.to_dict(resolve_text=True), f, ensure_ascii=False, indent=2)
                 self.show_message("Экспорт", "История успешно сохранена.", QMessageBox.Information)
             except Exception as e:
                 self.show_message("Ошибка экспорта", f"Не удалось сохранить файл: {e}", QMessageBox.Critical)
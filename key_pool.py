@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from config import YANDEX_CREDENTIALS, YANDEX_KEY_RPS, YANDEX_KEY_BURST, YANDEX_KEY_MAX_CONCURRENCY
+
+class RateLimitError(ConnectionError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class Credential:
+    def __init__(self, api_key, folder_id, rate=1.0, burst=3, max_concurrency=8):
+        self.api_key = api_key
+        self.folder_id = folder_id
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.concurrency_limit = 1.0
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.rate_limited_count = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return (now >= self.cooldown_until and self.tokens >= 1 and
+                self.in_flight < int(self.concurrency_limit))
+
+    def wait_time(self, now):
+        self._refill(now)
+        return max(self.cooldown_until - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def load(self):
+        return self.in_flight / self.concurrency_limit
+
+    def acquire(self, now):
+        self.tokens -= 1
+        self.in_flight += 1
+
+    def release(self, now, succeeded, rate_limited=False, retry_after=None):
+        self.in_flight -= 1
+        if rate_limited:
+            self.rate_limited_count += 1
+            self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            backoff = retry_after if retry_after is not None else min(60.0, 2.0 ** self.rate_limited_count)
+            self.cooldown_until = max(self.cooldown_until, now + backoff)
+        elif succeeded:
+            self.rate_limited_count = 0
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+class KeyPool:
+    def __init__(self, credentials):
+        self.credentials = list(credentials)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        return cls(Credential(api_key, folder_id, YANDEX_KEY_RPS, YANDEX_KEY_BURST, YANDEX_KEY_MAX_CONCURRENCY)
+                   for api_key, folder_id in YANDEX_CREDENTIALS)
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [c for c in self.credentials if c.available(now)]
+            if candidates:
+                credential = min(candidates, key=lambda c: (c.load(), -c.tokens))
+                credential.acquire(now)
+                return credential, 0.0
+            return None, min(c.wait_time(now) for c in self.credentials)
+
+    async def acquire(self):
+        while True:
+            credential, wait = self.try_acquire()
+            if credential:
+                return credential
+            await asyncio.sleep(min(max(wait, 0.01), 1.0))
+
+    def release(self, credential, succeeded, rate_limited=False, retry_after=None):
+        with self._lock:
+            credential.release(time.monotonic(), succeeded, rate_limited, retry_after)
+
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+def get_key_pool():
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            _key_pool = KeyPool.from_config()
+        return _key_pool
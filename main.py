@@ -3,22 +3,46 @@ from PyQt5.QtWidgets import QApplication
 from PyQt5.QtGui import QFont
 
 from gui import MainWindow
-from story_generator import StoryGeneratorWorker
+from story_generator import StoryGeneratorWorker, SubtreeGeneratorWorker, SpeculativeGenerator
 from StoryObject import StoryObject
+from story_document import StoryDocument
+import settings
 
 class ApplicationLogic:
     def __init__(self, main_window: MainWindow):
         self.gui = main_window
         self.worker = None
         self.gui.storyRequested.connect(self.start_story_generation)
+        self.gui.subtreeRequested.connect(self.start_subtree_generation)
+
+        self.speculation = SpeculativeGenerator(settings.SPECULATIVE['max_wasted'])
+        self.speculation.finished.connect(self.gui.set_story_data)
+        self.speculation.error.connect(self.gui.handle_generation_error)
+        self.gui.speculationRequested.connect(self.speculation.speculate)
+        self.gui.speculationToggled.connect(self.on_speculation_toggled)
+
+    def on_speculation_toggled(self, enabled: bool):
+        if enabled:
+            self.speculation.reset()
+        else:
+            self.speculation.discard()
 
     def start_story_generation(self, story_object: StoryObject):
-        self.worker = StoryGeneratorWorker(story_object)
+        if self.speculation.claim(story_object):
+            return
+        self._start_worker(StoryGeneratorWorker(story_object))
+
+    def start_subtree_generation(self, document: StoryDocument, scene_id: str, story_object: StoryObject):
+        self._start_worker(SubtreeGeneratorWorker(document, scene_id, story_object))
+
+    def _start_worker(self, worker):
+        self.worker = worker
         self.worker.finished.connect(self.gui.set_story_data)
         self.worker.error.connect(self.gui.handle_generation_error)
         self.worker.start()
 
     def cleanup_on_exit(self):
+        self.speculation.cleanup()
         if self.worker and self.worker.isRunning():
             self.worker.quit()
             self.worker.wait()
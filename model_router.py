@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+
+import settings
+from config import MODEL_STATS_PATH
+
+OUTCOMES = ('ok', 'repaired', 'truncated', 'failed')
+
+class ModelStats:
+    __slots__ = ('requests', 'latency', 'failure_rate', 'truncation_rate', 'repair_rate')
+
+    def __init__(self, requests=0, latency=None, failure_rate=0.0, truncation_rate=0.0, repair_rate=0.0):
+        self.requests = requests
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.truncation_rate = truncation_rate
+        self.repair_rate = repair_rate
+
+    @property
+    def invalid_rate(self):
+        return self.failure_rate + self.truncation_rate
+
+    def record(self, outcome, latency, smoothing):
+        self.requests += 1
+        alpha = max(smoothing, 1.0 / self.requests)
+        if latency is not None and outcome != 'failed':
+            self.latency = latency if self.latency is None else self.latency + alpha * (latency - self.latency)
+        self.failure_rate += alpha * ((outcome == 'failed') - self.failure_rate)
+        self.truncation_rate += alpha * ((outcome == 'truncated') - self.truncation_rate)
+        self.repair_rate += alpha * ((outcome == 'repaired') - self.repair_rate)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class ModelRouter:
+    def __init__(self, models, size_buckets, min_samples=5, max_invalid_rate=0.25, probe_every=20,
+                 smoothing=0.2, repair_penalty=0.5, path=None):
+        if not models:
+            raise ValueError("Список моделей для маршрутизации пуст.")
+        self.models = models
+        self.size_buckets = sorted(size_buckets)
+        self.min_samples = min_samples
+        self.max_invalid_rate = max_invalid_rate
+        self.probe_every = probe_every
+        self.smoothing = smoothing
+        self.repair_penalty = repair_penalty
+        self.path = path
+        self.stats = {}
+        self.escalated = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def bucket(self, scene_count):
+        for limit in self.size_buckets:
+            if scene_count is None or scene_count <= limit:
+                return str(limit)
+        return f">{self.size_buckets[-1]}"
+
+    def _stats(self, model, bucket):
+        return self.stats.setdefault((model['name'], bucket), ModelStats())
+
+    def _acceptable(self, stats):
+        return stats.requests < self.min_samples or stats.invalid_rate <= self.max_invalid_rate
+
+    def _cost(self, stats):
+        if stats.latency is None:
+            return float('inf')
+        return stats.latency * (1.0 + self.repair_penalty * stats.repair_rate)
+
+    def choose(self, scene_count=None):
+        bucket = self.bucket(scene_count)
+        with self._lock:
+            stats = [self._stats(model, bucket) for model in self.models]
+            if self._acceptable(stats[0]):
+                return self.models[0]
+
+            acceptable = [i for i in range(1, len(stats)) if self._acceptable(stats[i])]
+            if not acceptable:
+                return self.models[min(range(len(stats)), key=lambda i: (stats[i].invalid_rate, i))]
+
+            best = min(acceptable, key=lambda i: (self._cost(stats[i]), i))
+
+            escalated = self.escalated.get(bucket, 0) + 1
+            self.escalated[bucket] = escalated
+            if self.probe_every and escalated % self.probe_every == 0:
+                return self.models[0]
+            return self.models[best]
+
+    def record(self, model, scene_count, outcome, latency=None):
+        if outcome not in OUTCOMES:
+            raise ValueError(f"Неизвестный результат запроса: {outcome}")
+        with self._lock:
+            self._stats(model, self.bucket(scene_count)).record(outcome, latency, self.smoothing)
+            snapshot = self._snapshot() if self.path else None
+        if snapshot is not None:
+            self._save(snapshot)
+
+    def _snapshot(self):
+        snapshot = {}
+        for (name, bucket), stats in self.stats.items():
+            snapshot.setdefault(name, {})[bucket] = stats.to_dict()
+        return snapshot
+
+    def summary(self):
+        with self._lock:
+            return self._snapshot()
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            stats = {(name, bucket): ModelStats(**values)
+                     for name, buckets in snapshot.items() for bucket, values in buckets.items()}
+        except (OSError, ValueError, TypeError, AttributeError):
+            return
+        self.stats.update(stats)
+
+    def _save(self, snapshot):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.MODELS, path=MODEL_STATS_PATH, **settings.ROUTING)
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+def get_model_router():
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter.from_settings()
+        return _model_router
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import time
+import uuid
+
+from aiohttp import web
+
+import ai
+from config import STORY_DEDUP
+from StoryObject import StoryObject
+
+class GenerationService:
+    def __init__(self, workers=2, queue_size=16, result_ttl=600, dedup=STORY_DEDUP):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.dedup = dedup
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs = {}
+        self.in_flight = {}
+        self._tasks = []
+
+    async def start(self, app=None):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, app=None):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, story_object: StoryObject):
+        self._purge_expired()
+
+        key = story_object.cache_key()
+        job_id = self.in_flight.get(key)
+        if job_id:
+            return self.jobs[job_id], True
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': 'queued',
+            'story_object': story_object,
+            'result': None,
+            'error': None,
+            'near_duplicates': [],
+            'created': time.monotonic(),
+            'finished': None
+        }
+        self.queue.put_nowait(job)
+        self.jobs[job['job_id']] = job
+        self.in_flight[key] = job['job_id']
+        return job, False
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            job['status'] = 'running'
+            try:
+                if self.dedup == 'off':
+                    job['result'] = await ai.get_story_from_ai(job['story_object'])
+                else:
+                    job['result'], report = await ai.get_unique_story_from_ai(
+                        job['story_object'], reject=self.dedup == 'reject', key=job['job_id'])
+                    job['near_duplicates'] = report['duplicates']
+                job['status'] = 'done'
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            finally:
+                job['finished'] = time.monotonic()
+                self.in_flight.pop(job['story_object'].cache_key(), None)
+                self.queue.task_done()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def status(self, job):
+        return {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'queue_size': self.queue.qsize(),
+            'error': job['error'],
+            'near_duplicates': job['near_duplicates']
+        }
+
+async def handle_generate(request):
+    service = request.app['service']
+    try:
+        body = await request.json()
+        story_object = StoryObject(
+            description=body.get('description', ''),
+            genre=body.get('genre', 'RPG'),
+            heroes=body.get('heroes', []),
+            mood=body.get('mood', 'neutral'),
+            scene_count=body.get('scene_count')
+        )
+        error_msg = story_object.validate()
+    except (ValueError, AttributeError, TypeError):
+        return web.json_response({'error': "Тело запроса должно быть JSON-объектом."}, status=400)
+
+    if error_msg:
+        return web.json_response({'error': error_msg}, status=400)
+
+    try:
+        job, coalesced = service.submit(story_object)
+    except asyncio.QueueFull:
+        return web.json_response({'error': "Очередь генерации заполнена, повторите позже."},
+                                 status=429, headers={'Retry-After': '5'})
+
+    return web.json_response({**service.status(job), 'coalesced': coalesced}, status=202)
+
+def _get_job(request):
+    job = request.app['service'].jobs.get(request.match_info['job_id'])
+    if job is None:
+        raise web.HTTPNotFound(text='{"error": "Задача не найдена."}', content_type='application/json')
+    return job
+
+async def handle_status(request):
+    return web.json_response(request.app['service'].status(_get_job(request)))
+
+async def handle_result(request):
+    job = _get_job(request)
+    if job['status'] == 'done':
+        return web.json_response(job['result'])
+    if job['status'] == 'failed':
+        return web.json_response(request.app['service'].status(job), status=502)
+    return web.json_response(request.app['service'].status(job), status=202)
+
+def create_app(workers=2, queue_size=16, result_ttl=600, dedup=STORY_DEDUP):
+    app = web.Application()
+    service = GenerationService(workers=workers, queue_size=queue_size, result_ttl=result_ttl, dedup=dedup)
+    app['service'] = service
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.router.add_post('/generate', handle_generate)
+    app.router.add_get('/status/{job_id}', handle_status)
+    app.router.add_get('/result/{job_id}', handle_result)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-сервис генерации историй")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--result-ttl', type=int, default=600)
+    parser.add_argument('--dedup', choices=('off', 'flag', 'reject'), default=STORY_DEDUP,
+                        help="проверка на почти дубликаты: отметить или отклонить и перегенерировать")
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.workers, args.queue_size, args.result_ttl, args.dedup),
+                host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
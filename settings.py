@@ -24,4 +24,44 @@ MOODS = {
         {'name': 'Экзистенциальное', 'value': 'existential'},
         {'name': 'Сюрреалистичное', 'value': 'surreal'},
     ]
+}
+
+ANALYSIS = {
+    'max_scenes': 5000
+}
+
+SPECULATIVE = {
+    'debounce_ms': 2500,
+    'max_wasted': 3
+}
+
+STORY_SIZES = {
+    'default': 12,
+    'options': [
+        {'name': 'Короткая (6-12 сцен)', 'value': 12},
+        {'name': 'Средняя (12-25 сцен)', 'value': 25},
+        {'name': 'Большая (25-50 сцен)', 'value': 50},
+    ]
+}
+
+MODELS = [
+    {
+        'name': 'yandexgpt-lite',
+        'uri': 'gpt://{folder_id}/yandexgpt-lite',
+        'options': {'temperature': 0.75, 'maxTokens': '16000'}
+    },
+    {
+        'name': 'yandexgpt',
+        'uri': 'gpt://{folder_id}/yandexgpt/latest',
+        'options': {'temperature': 0.75, 'maxTokens': '16000'}
+    },
+]
+
+ROUTING = {
+    'size_buckets': [12, 25, 50],
+    'min_samples': 5,
+    'max_invalid_rate': 0.25,
+    'probe_every': 20,
+    'smoothing': 0.2,
+    'repair_penalty': 0.5
 }
\ No newline at end of file
@@ -0,0 +1,201 @@
+import numpy as np
+
+from story_document import StoryDocument
+
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+except ImportError:
+    sparse = None
+
+SPARSE_THRESHOLD = 300
+ITERATIVE_MAX_STEPS = 10000
+ITERATIVE_TOLERANCE = 1e-10
+MONTE_CARLO_BATCH = 100000
+MONTE_CARLO_MAX_STEPS = 5000
+
+
+def _as_document(story):
+    return story if isinstance(story, StoryDocument) else StoryDocument.from_dict(story)
+
+
+def transition_matrix(story, weighted=False):
+    document = _as_document(story)
+    scene_ids = document.scene_ids()
+    index = {scene_id: i for i, scene_id in enumerate(scene_ids)}
+
+    rows, cols, values = [], [], []
+    for scene in document.scenes:
+        row = index[scene.scene_id]
+        for choice in scene.choices:
+            target = index.get(choice.next_scene)
+            if target is None:
+                continue
+            rows.append(row)
+            cols.append(target)
+            values.append(float((choice.extra or {}).get('weight', 1.0)) if weighted else 1.0)
+
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    row_sums = np.bincount(rows, weights=values, minlength=len(scene_ids))
+    absorbing = row_sums <= 0
+    keep = ~absorbing[rows]
+    rows, cols, values = rows[keep], cols[keep], values[keep] / row_sums[rows[keep]]
+    return scene_ids, index, (rows, cols, values), absorbing
+
+
+def _reachable(n, rows, cols, sources):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.searchsorted(rows[order], np.arange(n + 1))
+    targets = cols[order]
+
+    seen = np.zeros(n, dtype=bool)
+    seen[sources] = True
+    frontier = np.asarray(sources, dtype=np.int64)
+    while len(frontier):
+        starts, ends = indptr[frontier], indptr[frontier + 1]
+        counts = ends - starts
+        if not counts.sum():
+            break
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        nxt = np.unique(targets[offsets])
+        frontier = nxt[~seen[nxt]]
+        seen[frontier] = True
+    return seen
+
+
+def _iterate_visits(size, rows, cols, values, rhs):
+    visits = rhs
+    for _ in range(ITERATIVE_MAX_STEPS):
+        updated = rhs + np.bincount(cols, weights=values * visits[rows], minlength=size)
+        if np.abs(updated - visits).max() <= ITERATIVE_TOLERANCE * max(1.0, updated.max()):
+            return updated
+        visits = updated
+    return None
+
+
+def _solve_absorbing(n, start, edges, absorbing, reachable):
+    if absorbing[start]:
+        return np.array([start]), np.array([1.0]), 0.0
+
+    rows, cols, values = edges
+    can_finish = _reachable(n, cols, rows, np.flatnonzero(absorbing))
+    if not can_finish[reachable].all():
+        return None
+
+    transient = np.flatnonzero(reachable & ~absorbing)
+    endings = np.flatnonzero(reachable & absorbing)
+    t_index = np.full(n, -1, dtype=np.int64)
+    t_index[transient] = np.arange(len(transient))
+    a_index = np.full(n, -1, dtype=np.int64)
+    a_index[endings] = np.arange(len(endings))
+
+    from_transient = t_index[rows] >= 0
+    q_mask = from_transient & (t_index[cols] >= 0)
+    r_mask = from_transient & (a_index[cols] >= 0)
+
+    size = len(transient)
+    rhs = np.zeros(size)
+    rhs[t_index[start]] = 1.0
+
+    q_rows, q_cols, q_values = t_index[rows[q_mask]], t_index[cols[q_mask]], values[q_mask]
+    if size < SPARSE_THRESHOLD:
+        q = np.zeros((size, size))
+        np.add.at(q, (q_rows, q_cols), q_values)
+        visits = np.linalg.solve((np.eye(size) - q).T, rhs)
+    elif sparse is not None:
+        q = sparse.csr_matrix((q_values, (q_rows, q_cols)), shape=(size, size))
+        visits = spsolve((sparse.identity(size, format='csc') - q).T.tocsc(), rhs)
+    else:
+        visits = _iterate_visits(size, q_rows, q_cols, q_values, rhs)
+
+    if visits is None or not np.all(np.isfinite(visits)):
+        return None
+
+    reach = np.zeros(len(endings))
+    np.add.at(reach, a_index[cols[r_mask]], visits[t_index[rows[r_mask]]] * values[r_mask])
+    return endings, reach, float(visits.sum())
+
+
+def _monte_carlo(n, start, edges, absorbing, walkers, max_steps, seed):
+    rows, cols, values = edges
+    order = np.lexsort((cols, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+
+    indptr = np.searchsorted(rows, np.arange(n + 1))
+    cumulative = np.cumsum(values)
+    row_offsets = np.zeros(n + 1)
+    row_offsets[1:] = np.cumsum(np.bincount(rows, weights=values, minlength=n))
+    cumulative = cumulative - row_offsets[rows]
+    last_in_row = indptr[1:][indptr[1:] > indptr[:-1]] - 1
+    cumulative[last_in_row] = 1.0
+    keys = rows + cumulative
+
+    rng = np.random.default_rng(seed)
+    hits = np.zeros(n, dtype=np.int64)
+    finished_steps = 0
+    finished = 0
+
+    for batch_start in range(0, walkers, MONTE_CARLO_BATCH):
+        batch = min(MONTE_CARLO_BATCH, walkers - batch_start)
+        position = np.full(batch, start, dtype=np.int64)
+        steps = np.zeros(batch, dtype=np.int64)
+        active = ~absorbing[position]
+
+        for _ in range(max_steps):
+            walking = np.flatnonzero(active)
+            if not len(walking):
+                break
+            edge = np.searchsorted(keys, position[walking] + rng.random(len(walking)), side='right')
+            position[walking] = cols[edge]
+            steps[walking] += 1
+            active[walking] = ~absorbing[position[walking]]
+
+        done = ~active
+        hits += np.bincount(position[done], minlength=n)
+        finished += int(done.sum())
+        finished_steps += int(steps[done].sum())
+
+    endings = np.flatnonzero(hits)
+    return (endings, hits[endings] / walkers,
+            finished_steps / finished if finished else None,
+            1.0 - finished / walkers)
+
+
+def analyze_story(story, weighted=False, walkers=20000, max_steps=None, seed=0):
+    document = _as_document(story)
+    scene_ids, index, edges, absorbing = transition_matrix(document, weighted)
+    start = index.get(document.start_scene)
+    if start is None:
+        return None
+
+    n = len(scene_ids)
+    reachable = _reachable(n, edges[0], edges[1], [start])
+    if not absorbing[reachable].any():
+        return {
+            'method': 'none',
+            'ending_probabilities': {},
+            'expected_length': None,
+            'unfinished': 1.0
+        }
+
+    solved = _solve_absorbing(n, start, edges, absorbing, reachable)
+    if solved is not None:
+        endings, reach, expected_length = solved
+        return {
+            'method': 'absorbing',
+            'ending_probabilities': {scene_ids[e]: float(p) for e, p in zip(endings, reach)},
+            'expected_length': expected_length,
+            'unfinished': 0.0
+        }
+
+    endings, reach, expected_length, unfinished = _monte_carlo(
+        n, start, edges, absorbing, walkers, max_steps or min(10 * n, MONTE_CARLO_MAX_STEPS), seed)
+    return {
+        'method': 'monte_carlo',
+        'ending_probabilities': {scene_ids[e]: float(p) for e, p in zip(endings, reach)},
+        'expected_length': expected_length,
+        'unfinished': unfinished
+    }
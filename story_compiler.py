@@ -0,0 +1,248 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from story_document import StoryDocument
+
+MAGIC = b'QSTB'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHIIIIII9I')
+_SECTIONS = ('scene_ids', 'scene_texts', 'choice_offsets', 'choice_texts', 'choice_targets',
+             'endings', 'string_offsets', 'strings')
+NO_TARGET = -1
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+
+    def add(self, text):
+        text_id = self.ids.get(text)
+        if text_id is None:
+            text_id = self.ids[text] = len(self.offsets) - 1
+            self.data += text.encode('utf-8')
+            self.offsets.append(len(self.data))
+        return text_id
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def compile_story(story):
+    document = story if isinstance(story, StoryDocument) else StoryDocument.from_dict(story)
+    if document.start_scene not in document:
+        raise ValueError(f"Стартовая сцена '{document.start_scene}' отсутствует в истории.")
+
+    index = {scene_id: i for i, scene_id in enumerate(document.scene_ids())}
+    strings = _StringTable()
+    title = strings.add(document.title or '')
+    description = strings.add(document.description or '')
+
+    scene_ids = array('I')
+    scene_texts = array('I')
+    choice_offsets = array('I', [0])
+    choice_texts = array('I')
+    choice_targets = array('i')
+    endings = bytearray((len(document) + 7) // 8)
+
+    for i, scene in enumerate(document.scenes):
+        scene_ids.append(strings.add(scene.scene_id))
+        scene_texts.append(strings.add(document.scene_text(scene.scene_id)))
+        for choice in scene.choices:
+            choice_texts.append(strings.add(choice.label))
+            choice_targets.append(index.get(choice.next_scene, NO_TARGET))
+        choice_offsets.append(len(choice_texts))
+        if scene.is_ending if scene.is_ending is not None else document.is_ending(scene.scene_id):
+            endings[i >> 3] |= 1 << (i & 7)
+
+    sections = [_little_endian(scene_ids), _little_endian(scene_texts), _little_endian(choice_offsets),
+                _little_endian(choice_texts), _little_endian(choice_targets), bytes(endings),
+                _little_endian(strings.offsets), bytes(strings.data)]
+
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        position += -position % 4
+        offsets.append(position)
+        position += len(section)
+
+    header = _HEADER.pack(MAGIC, VERSION, 0, len(document), len(choice_texts), len(strings.offsets) - 1,
+                          index[document.start_scene], title, description, *offsets, position)
+    output = bytearray(header)
+    for offset, section in zip(offsets, sections):
+        output += bytes(offset - len(output))
+        output += section
+    return bytes(output)
+
+
+def write_compiled(story, path):
+    data = compile_story(story)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+class CompiledStory:
+    def __init__(self, buffer, mapping=None):
+        self._mapping = mapping
+        self.buffer = memoryview(buffer)
+        if len(self.buffer) < _HEADER.size:
+            raise ValueError("Файл слишком короткий для скомпилированной истории.")
+
+        (magic, version, _, self.scene_count, self.choice_count, self.string_count,
+         self.start, self._title, self._description, *offsets) = _HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("Файл не является скомпилированной историей.")
+        if version != VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {version}")
+        if offsets[-1] > len(self.buffer) or any(a > b for a, b in zip(offsets, offsets[1:])):
+            raise ValueError("Скомпилированная история повреждена или обрезана.")
+
+        bounds = dict(zip(_SECTIONS, zip(offsets, offsets[1:])))
+        lengths = {
+            'scene_ids': self.scene_count, 'scene_texts': self.scene_count,
+            'choice_offsets': self.scene_count + 1, 'choice_texts': self.choice_count,
+            'choice_targets': self.choice_count, 'string_offsets': self.string_count + 1
+        }
+        for name, count in lengths.items():
+            start, end = bounds[name]
+            if start + 4 * count > end:
+                raise ValueError("Скомпилированная история повреждена или обрезана.")
+            typecode = 'i' if name == 'choice_targets' else 'I'
+            setattr(self, name, self._table(start, count, typecode))
+        start = bounds['endings'][0]
+        self.endings = self.buffer[start:start + (self.scene_count + 7) // 8]
+        self.strings = self.buffer[bounds['strings'][0]:offsets[-1]]
+        self._index = None
+
+    def _table(self, start, count, typecode):
+        view = self.buffer[start:start + 4 * count]
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        values = array(typecode, view)
+        values.byteswap()
+        return values
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapping, mapping)
+
+    def close(self):
+        for name in _SECTIONS[:-1] + ('strings', 'buffer'):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.scene_count
+
+    def string(self, string_id):
+        return str(self.strings[self.string_offsets[string_id]:self.string_offsets[string_id + 1]], 'utf-8')
+
+    @property
+    def title(self):
+        return self.string(self._title)
+
+    @property
+    def description(self):
+        return self.string(self._description)
+
+    def scene_id(self, scene):
+        return self.string(self.scene_ids[scene])
+
+    def scene_text(self, scene):
+        return self.string(self.scene_texts[scene])
+
+    def scene_index(self, scene_id):
+        if self._index is None:
+            self._index = {self.scene_id(i): i for i in range(self.scene_count)}
+        return self._index.get(scene_id)
+
+    def is_ending(self, scene):
+        return bool(self.endings[scene >> 3] & (1 << (scene & 7)))
+
+    def choice_count_of(self, scene):
+        return self.choice_offsets[scene + 1] - self.choice_offsets[scene]
+
+    def choice_texts_of(self, scene):
+        return [self.string(self.choice_texts[k])
+                for k in range(self.choice_offsets[scene], self.choice_offsets[scene + 1])]
+
+
+class StoryRuntime:
+    __slots__ = ('story', 'scene')
+
+    def __init__(self, story, scene=None):
+        self.story = story
+        self.scene = story.start if scene is None else scene
+
+    def reset(self):
+        self.scene = self.story.start
+
+    @property
+    def scene_id(self):
+        return self.story.scene_id(self.scene)
+
+    @property
+    def text(self):
+        return self.story.scene_text(self.scene)
+
+    @property
+    def is_ending(self):
+        return self.story.is_ending(self.scene)
+
+    def choices(self):
+        return self.story.choice_texts_of(self.scene)
+
+    def choice_count(self):
+        offsets = self.story.choice_offsets
+        return offsets[self.scene + 1] - offsets[self.scene]
+
+    def choose(self, choice):
+        offsets = self.story.choice_offsets
+        first = offsets[self.scene]
+        if not 0 <= choice < offsets[self.scene + 1] - first:
+            raise IndexError(f"В сцене '{self.scene_id}' нет выбора с номером {choice}.")
+        target = self.story.choice_targets[first + choice]
+        if target == NO_TARGET:
+            raise ValueError(f"Выбор {choice} в сцене '{self.scene_id}' ведёт в несуществующую сцену.")
+        self.scene = target
+        return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компиляция истории в формат для игровых клиентов")
+    parser.add_argument('input', help="JSON-файл истории")
+    parser.add_argument('-o', '--output', help="путь к скомпилированному файлу (по умолчанию рядом, .qsb)")
+    args = parser.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        story = json.load(f)
+    output = args.output or args.input.rsplit('.', 1)[0] + '.qsb'
+    size = write_compiled(story, output)
+    print(f"{output}: {len(story.get('scenes', []))} сцен, {size} байт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+def diff_stories(old_document, new_document):
+    old_index = old_document.index if old_document is not None else {}
+    old_edges = old_document.edges if old_document is not None else {}
+    new_edges = new_document.edges
+
+    return {
+        'added_nodes': [n for n in new_document.scene_ids() if n not in old_index],
+        'removed_nodes': [n for n in old_index if n not in new_document],
+        'added_edges': {e: label for e, label in new_edges.items() if e not in old_edges},
+        'removed_edges': [e for e in old_edges if e not in new_edges],
+        'relabeled_edges': {e: label for e, label in new_edges.items()
+                            if e in old_edges and old_edges[e] != label},
+        'start_changed': old_document is None or old_document.start_scene != new_document.start_scene
+    }
+
+
+def diff_size(diff):
+    return (len(diff['added_nodes']) + len(diff['removed_nodes']) +
+            len(diff['added_edges']) + len(diff['removed_edges']))
@@ -0,0 +1,193 @@
+_SCENE_KEYS = ('scene_id', 'text', 'choices', 'is_ending')
+_CHOICE_KEYS = ('text', 'next_scene')
+_STORY_KEYS = ('title', 'description', 'start_scene', 'scenes')
+
+MISSING = ()
+
+
+def _extra(data, keys):
+    return {k: v for k, v in data.items() if k not in keys or v is None} or None
+
+
+class Choice:
+    __slots__ = ('text', 'next_scene', 'extra')
+
+    def __init__(self, text, next_scene, extra=None):
+        self.text = text
+        self.next_scene = next_scene
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('text'), data.get('next_scene'), _extra(data, _CHOICE_KEYS))
+
+    @property
+    def label(self):
+        return self.text if self.text is not None else '...'
+
+    def to_dict(self):
+        data = {}
+        if self.text is not None:
+            data['text'] = self.text
+        if self.next_scene is not None:
+            data['next_scene'] = self.next_scene
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class Scene:
+    __slots__ = ('scene_id', 'text', 'choices', 'is_ending', 'extra')
+
+    def __init__(self, scene_id, text, choices, is_ending=None, extra=None):
+        self.scene_id = scene_id
+        self.text = text
+        self.choices = choices
+        self.is_ending = is_ending
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        choices = data.get('choices')
+        return cls(
+            data['scene_id'],
+            data.get('text'),
+            [Choice.from_dict(c) for c in choices] if choices is not None else MISSING,
+            data.get('is_ending'),
+            _extra(data, _SCENE_KEYS)
+        )
+
+    def to_dict(self, text=None):
+        data = {'scene_id': self.scene_id}
+        text = self.text if text is None else text
+        if text is not None:
+            data['text'] = text
+        if self.choices is not MISSING:
+            data['choices'] = [c.to_dict() for c in self.choices]
+        if self.is_ending is not None:
+            data['is_ending'] = self.is_ending
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class StoryDocument:
+    __slots__ = ('title', 'description', 'start_scene', 'scenes', 'extra', 'text_provider',
+                 '_index', '_edges', '_successors', '_predecessors', '_endings')
+
+    def __init__(self, title, description, start_scene, scenes, extra=None, text_provider=None):
+        self.title = title
+        self.description = description
+        self.start_scene = start_scene
+        self.scenes = scenes
+        self.extra = extra
+        self.text_provider = text_provider
+        self.reindex()
+
+    @classmethod
+    def from_dict(cls, data, text_provider=None):
+        scenes = data.get('scenes')
+        return cls(
+            data.get('title'),
+            data.get('description'),
+            data.get('start_scene'),
+            [Scene.from_dict(s) for s in scenes] if scenes is not None else MISSING,
+            _extra(data, _STORY_KEYS),
+            text_provider
+        )
+
+    def to_dict(self, resolve_text=False):
+        data = {}
+        for key in ('title', 'description', 'start_scene'):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        if self.scenes is not MISSING:
+            data['scenes'] = [s.to_dict(self.scene_text(s.scene_id) if resolve_text and s.text is None else None)
+                              for s in self.scenes]
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def reindex(self):
+        self._index = self._edges = self._successors = self._predecessors = self._endings = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {scene.scene_id: scene for scene in self.scenes}
+        return self._index
+
+    def _build_edges(self):
+        index = self.index
+        edges = {}
+        successors = {}
+        for scene in self.scenes:
+            targets = []
+            for choice in scene.choices:
+                if choice.next_scene and choice.next_scene in index:
+                    edge = (scene.scene_id, choice.next_scene)
+                    if edge not in edges:
+                        targets.append(choice.next_scene)
+                    edges[edge] = choice.label
+            successors[scene.scene_id] = targets
+        self._edges = edges
+        self._successors = successors
+
+    @property
+    def edges(self):
+        if self._edges is None:
+            self._build_edges()
+        return self._edges
+
+    @property
+    def successor_index(self):
+        if self._successors is None:
+            self._build_edges()
+        return self._successors
+
+    @property
+    def predecessor_index(self):
+        if self._predecessors is None:
+            predecessors = {scene_id: [] for scene_id in self.index}
+            for scene_id, targets in self.successor_index.items():
+                for target in targets:
+                    predecessors[target].append(scene_id)
+            self._predecessors = predecessors
+        return self._predecessors
+
+    @property
+    def endings(self):
+        if self._endings is None:
+            self._endings = frozenset(sid for sid, targets in self.successor_index.items() if not targets)
+        return self._endings
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def __contains__(self, scene_id):
+        return scene_id in self.index
+
+    def scene(self, scene_id):
+        return self.index.get(scene_id)
+
+    def scene_ids(self):
+        return [scene.scene_id for scene in self.scenes]
+
+    def scene_text(self, scene_id):
+        scene = self.index.get(scene_id)
+        if scene is None:
+            return 'Описание отсутствует.'
+        text = scene.text
+        if text is None and self.text_provider:
+            text = self.text_provider(scene_id)
+        return text if text is not None else 'Описание отсутствует.'
+
+    def successors(self, scene_id):
+        return self.successor_index.get(scene_id, [])
+
+    def predecessors(self, scene_id):
+        return self.predecessor_index.get(scene_id, [])
+
+    def is_ending(self, scene_id):
+        return scene_id in self.endings
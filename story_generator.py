@@ -1,7 +1,9 @@
 import asyncio
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 import ai
+import timing
 from StoryObject import StoryObject
+from story_document import StoryDocument
 
 class StoryGeneratorWorker(QThread):
     finished = pyqtSignal(dict)
@@ -10,20 +12,136 @@ class StoryGeneratorWorker(QThread):
     def __init__(self, story_object: StoryObject):
         super().__init__()
         self.story_object = story_object
+        self.timed = True
+        self.loop = None
+        self.task = None
+        self.cancelled = False
 
     def run(self):
+        if self.timed:
+            timing.begin(type(self).__name__)
+        else:
+            timing.mute()
         try:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
+            self.loop = loop
+            self.task = loop.create_task(self.generate())
+            if self.cancelled:
+                self.task.cancel()
             
-            story_data = loop.run_until_complete(ai.get_story_from_ai(self.story_object))
+            story_data = loop.run_until_complete(self.task)
             
             if story_data:
                 self.finished.emit(story_data)
             else:
                 self.error.emit("AI не вернул результат. Попробуйте изменить запрос.")
                 
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
             self.error.emit(f"Ошибка: {str(e)}")
         finally:
-            loop.close()
\ No newline at end of file
+            loop.close()
+
+    def cancel(self):
+        self.cancelled = True
+        loop, task = self.loop, self.task
+        if loop and task and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass
+
+    def generate(self):
+        return ai.get_story_from_ai(self.story_object)
+
+class SubtreeGeneratorWorker(StoryGeneratorWorker):
+    def __init__(self, document: StoryDocument, scene_id: str, story_object: StoryObject):
+        super().__init__(story_object)
+        self.document = document
+        self.scene_id = scene_id
+
+    def generate(self):
+        return ai.regenerate_subtree(self.document, self.scene_id, self.story_object)
+
+class SpeculativeGenerator(QObject):
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, max_wasted: int):
+        super().__init__()
+        self.max_wasted = max_wasted
+        self.wasted = 0
+        self.worker = None
+        self.adopted = None
+        self.key = None
+        self.result = None
+        self.failed = False
+        self._retired = []
+
+    def reset(self):
+        self.discard()
+        self.wasted = 0
+
+    def speculate(self, story_object: StoryObject):
+        key = story_object.cache_key()
+        if key == self.key:
+            return
+        self.discard()
+        if self.wasted >= self.max_wasted:
+            return
+
+        worker = StoryGeneratorWorker(story_object)
+        worker.timed = False
+        worker.finished.connect(lambda story_data: self._on_finished(worker, story_data))
+        worker.error.connect(lambda message: self._on_error(worker, message))
+        self.worker = worker
+        self.key = key
+        worker.start()
+
+    def claim(self, story_object: StoryObject):
+        if self.worker is None:
+            return False
+        if story_object.cache_key() != self.key or self.failed:
+            self.discard()
+            return False
+
+        worker, result = self.worker, self.result
+        self.worker = self.key = self.result = None
+        if result is not None:
+            self.finished.emit(result)
+        else:
+            self.adopted = worker
+        return True
+
+    def discard(self):
+        if self.worker is None:
+            return
+        self.wasted += 1
+        self._retired = [w for w in self._retired if w.isRunning()]
+        if self.worker.isRunning():
+            self.worker.cancel()
+            self._retired.append(self.worker)
+        self.worker = self.key = self.result = None
+        self.failed = False
+
+    def _on_finished(self, worker, story_data):
+        if worker is self.worker:
+            self.result = story_data
+        elif worker is self.adopted:
+            self.adopted = None
+            self.finished.emit(story_data)
+
+    def _on_error(self, worker, message):
+        if worker is self.worker:
+            self.failed = True
+        elif worker is self.adopted:
+            self.adopted = None
+            self.error.emit(message)
+
+    def cleanup(self):
+        for worker in [self.worker, self.adopted] + self._retired:
+            if worker and worker.isRunning():
+                worker.cancel()
+                worker.wait()
@@ -6,6 +6,7 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QTextEdit, QPushButton,
                              QHBoxLayout, QToolTip)
 from PyQt5.QtGui import QCursor
+from PyQt5.QtCore import pyqtSignal
 import matplotlib.patches as mpatches
 import aiohttp
 import json
@@ -13,6 +14,9 @@ import re
 
 from config import YANDEX_ID_KEY, YANDEX_API_KEY
 from StoryObject import StoryObject
+from story_diff import diff_stories, diff_size
+from story_document import StoryDocument
+import timing
 
 def clean_json_response(text: str) -> str:
     text = re.sub(r'^```(?:json)?\s*', '', text, flags=re.MULTILINE)
@@ -153,10 +157,10 @@ async def get_story_from_ai(story_object: StoryObject) -> dict:
         raise RuntimeError(f"Неожиданная ошибка при работе с AI: {e}")
 
 class SceneDetailDialog(QDialog):
-    def __init__(self, scene_data, parent=None):
+    def __init__(self, scene_id, description_text, parent=None):
         super().__init__(parent)
-        self.scene_data = scene_data
-        self.setWindowTitle(f"Детали сцены: {scene_data.get('scene_id', 'N/A')}")
+        self.description_text = description_text
+        self.setWindowTitle(f"Детали сцены: {scene_id}")
         self.setMinimumSize(500, 400)
         self.setStyleSheet("""
             QDialog { background-color: #2d2d44; border: 1px solid #4a4a6a; }
@@ -174,10 +178,9 @@ class SceneDetailDialog(QDialog):
 
     def _setup_ui(self):
         layout = QVBoxLayout(self)
-        description_text = self.scene_data.get('text', 'Описание отсутствует.')
         self.text_edit = QTextEdit()
         self.text_edit.setReadOnly(True)
-        self.text_edit.setText(description_text)
+        self.text_edit.setText(self.description_text)
         layout.addWidget(self.text_edit)
 
         self.close_button = QPushButton("Закрыть")
@@ -190,17 +193,19 @@ class SceneDetailDialog(QDialog):
 
 
 class StoryGraph(FigureCanvas):
+    selectionChanged = pyqtSignal(object)
+
     def __init__(self, parent=None):
         self.fig, self.ax = plt.subplots(figsize=(12, 10), facecolor='#1e1e2d')
         super().__init__(self.fig)
         self.G = nx.DiGraph()
-        self.story_data = {}
+        self.document = None
         self.node_positions = {}
-        self.edge_labels = {}
         self.selected_node = None
         self.hovered_edge = None
         self.edge_paths = {}
         self.press = None
+        self._reset_artists()
 
         self.draw_empty_graph("Ожидание генерации истории...")
 
@@ -224,38 +229,113 @@ class StoryGraph(FigureCanvas):
 
     def draw_empty_graph(self, message):
         self.ax.clear()
+        self._reset_artists()
         self.ax.set_facecolor('#1e1e2d')
         self.ax.text(0.5, 0.5, message, ha='center', va='center',
                      transform=self.ax.transAxes, fontsize=14, color='white', wrap=True)
         self.ax.axis('off')
         self.draw()
 
-    def update_graph(self, story_data):
-        self.story_data = story_data
-        self.G.clear()
-        self.edge_labels.clear()
-        self.selected_node = None
-        self.hovered_edge = None
+    def _reset_artists(self):
+        self.node_collection = None
+        self.selection_artist = None
+        self.label_artists = {}
+        self.edge_artists = {}
+        self.edge_paths.clear()
 
-        scenes = story_data.get('scenes', [])
-        if not scenes:
-            self.draw_empty_graph("В сгенерированной истории нет сцен."); return
+    def update_graph(self, story, text_provider=None):
+        old_document = self.document
+        self.document = story if isinstance(story, StoryDocument) else StoryDocument.from_dict(story, text_provider)
 
-        for scene in scenes:
-            self.G.add_node(scene['scene_id'])
+        if not len(self.document):
+            self._rebuild_graph()
+            self.draw_empty_graph("В сгенерированной истории нет сцен."); return
 
-        for scene in scenes:
-            for choice in scene.get('choices', []):
-                next_scene_id = choice.get('next_scene')
-                if next_scene_id and self.G.has_node(next_scene_id):
-                    self.G.add_edge(scene['scene_id'], next_scene_id)
-                    self.edge_labels[(scene['scene_id'], next_scene_id)] = choice.get('text', '...')
+        if self.node_collection is not None and self.G.nodes():
+            diff = diff_stories(old_document, self.document)
+            graph_size = self.G.number_of_nodes() + self.G.number_of_edges()
+            if not diff['start_changed'] and diff_size(diff) * 2 <= graph_size:
+                self._apply_diff(diff)
+                return
 
+        with timing.span('graph_build'):
+            self._rebuild_graph()
         self.redraw_graph()
+        self.selectionChanged.emit(self.selected_node)
+
+    def _rebuild_graph(self):
+        self.G.clear()
+        self.selected_node = None
+        self.hovered_edge = None
+
+        self.G.add_nodes_from(self.document.scene_ids())
+        self.G.add_edges_from(self.document.edges)
+
+    def _apply_diff(self, diff):
+        with timing.span('graph_build'):
+            self._apply_graph_diff(diff)
+        with timing.span('layout'):
+            self._place_new_nodes(diff['added_nodes'])
+        with timing.span('draw'):
+            for node in diff['added_nodes']:
+                self._add_label_artist(node)
+            for edge in diff['added_edges']:
+                self._add_edge_artist(edge)
+
+            self._update_node_collection()
+            self._update_selection_artist()
+            self.draw_idle()
+        self.selectionChanged.emit(self.selected_node)
+
+    def _apply_graph_diff(self, diff):
+        for edge in diff['removed_edges']:
+            self.G.remove_edge(*edge)
+            self._remove_edge_artist(edge)
+            if self.hovered_edge == edge:
+                self.hovered_edge = None
+
+        for node in diff['removed_nodes']:
+            self.G.remove_node(node)
+            self.node_positions.pop(node, None)
+            label = self.label_artists.pop(node, None)
+            if label is not None:
+                label.remove()
+            if self.selected_node == node:
+                self.selected_node = None
+
+        self.G.add_nodes_from(diff['added_nodes'])
+        self.G.add_edges_from(diff['added_edges'])
+
+    def _place_new_nodes(self, new_nodes):
+        y_spacing = -2.0
+        pending = list(new_nodes)
+
+        while pending:
+            remaining = []
+            for node in pending:
+                placed_preds = [p for p in self.G.predecessors(node) if p in self.node_positions]
+                if not placed_preds:
+                    remaining.append(node)
+                    continue
+                y = min(self.node_positions[p][1] for p in placed_preds) + y_spacing
+                self.node_positions[node] = (self._next_free_x(y, self.node_positions[placed_preds[0]][0]), y)
+
+            if len(remaining) == len(pending):
+                bottom = min(y for _, y in self.node_positions.values()) if self.node_positions else 0.0
+                node = remaining.pop(0)
+                self.node_positions[node] = (self._next_free_x(bottom + y_spacing, 0.0), bottom + y_spacing)
+            pending = remaining
+
+    def _next_free_x(self, y, preferred_x):
+        x_spacing = 2.0
+        row = [x for x, node_y in self.node_positions.values() if abs(node_y - y) < 1e-9]
+        if not row or all(abs(x - preferred_x) >= x_spacing for x in row):
+            return preferred_x
+        return max(row) + x_spacing
 
     def _custom_hierarchical_layout(self):
         if not self.G.nodes(): return {}
-        start_node = self.story_data.get('start_scene')
+        start_node = self.document.start_scene
         pos = {}
         
         reachable_nodes = set()
@@ -301,13 +381,15 @@ class StoryGraph(FigureCanvas):
 
     def redraw_graph(self):
         self.ax.clear()
+        self._reset_artists()
         self.ax.set_facecolor('#1e1e2d')
         self.ax.axis('off')
 
         if not self.G.nodes:
             self.draw_empty_graph("Граф пуст."); return
             
-        self.node_positions = self._custom_hierarchical_layout()
+        with timing.span('layout'):
+            self.node_positions = self._custom_hierarchical_layout()
 
         if self.node_positions:
             if self.ax.get_xlim() == (0.0, 1.0) and self.ax.get_ylim() == (0.0, 1.0):
@@ -319,47 +401,88 @@ class StoryGraph(FigureCanvas):
                 self.ax.set_xlim(min(x_coords) - x_margin, max(x_coords) + x_margin)
                 self.ax.set_ylim(min(y_coords) - y_margin, max(y_coords) + y_margin)
 
-        start_node = self.story_data.get('start_scene')
-        end_nodes = [n for n, d in self.G.out_degree() if d == 0]
-        node_colors = ['#51cf66' if n == start_node else '#ff6b6b' if n in end_nodes else '#4dabf7' for n in self.G.nodes()]
-
-        self.edge_paths.clear()
-        for edge in self.G.edges():
-            source, target = edge
-            pos_s = self.node_positions[source]
-            pos_t = self.node_positions[target]
-            
-            edge_color = '#FFD700' if edge == self.hovered_edge else '#aaaaaa'
-            edge_width = 3.0 if edge == self.hovered_edge else 2.0
-
-            arrow = mpatches.FancyArrowPatch(
-                posA=pos_s, posB=pos_t, 
-                connectionstyle=f"arc3,rad=0.1",
-                color=edge_color, 
-                linewidth=edge_width, 
-                arrowstyle='-|>',
-                mutation_scale=30,
-                shrinkA=30,
-                shrinkB=30,
-                alpha=0.8
-            )
-            self.ax.add_patch(arrow)
-            self.edge_paths[edge] = arrow.get_path().vertices
-
-        nx.draw_networkx_nodes(self.G, self.node_positions, ax=self.ax, node_size=2500, 
-                              node_color=node_colors, edgecolors="white", linewidths=1.5)
-        nx.draw_networkx_labels(self.G, self.node_positions, {n: str(n) for n in self.G.nodes()}, 
-                               font_size=11, font_color="white", font_weight="bold")
-
-        if self.selected_node:
-            nx.draw_networkx_nodes(self.G, self.node_positions, nodelist=[self.selected_node], ax=self.ax, node_size=2600, node_color='none', edgecolors='#FFD700', linewidths=3)
-
-        self.draw()
+        with timing.span('draw'):
+            for edge in self.G.edges():
+                self._add_edge_artist(edge)
+
+            self._update_node_collection()
+            for node in self.G.nodes():
+                self._add_label_artist(node)
+            self._update_selection_artist()
+
+            self.draw()
+
+    def _node_colors(self, nodes):
+        start_node = self.document.start_scene
+        return ['#51cf66' if n == start_node else '#ff6b6b' if self.document.is_ending(n) else '#4dabf7'
+                for n in nodes]
+
+    def _update_node_collection(self):
+        nodes = list(self.G.nodes())
+        if self.node_collection is not None:
+            self.node_collection.remove()
+        self.node_collection = nx.draw_networkx_nodes(self.G, self.node_positions, nodelist=nodes, ax=self.ax,
+                                                      node_size=2500, node_color=self._node_colors(nodes),
+                                                      edgecolors="white", linewidths=1.5)
+        self.node_collection.set_zorder(2)
+
+    def _add_label_artist(self, node):
+        x, y = self.node_positions[node]
+        self.label_artists[node] = self.ax.text(x, y, str(node), fontsize=11, color="white",
+                                                fontweight="bold", ha='center', va='center',
+                                                zorder=4, clip_on=True)
+
+    def _add_edge_artist(self, edge):
+        source, target = edge
+        arrow = mpatches.FancyArrowPatch(
+            posA=self.node_positions[source], posB=self.node_positions[target], 
+            connectionstyle=f"arc3,rad=0.1",
+            color='#aaaaaa', 
+            linewidth=2.0, 
+            arrowstyle='-|>',
+            mutation_scale=30,
+            shrinkA=30,
+            shrinkB=30,
+            alpha=0.8
+        )
+        self.ax.add_patch(arrow)
+        self.edge_artists[edge] = arrow
+        self.edge_paths[edge] = arrow.get_path().vertices
+        self._style_edge(edge)
+
+    def _remove_edge_artist(self, edge):
+        arrow = self.edge_artists.pop(edge, None)
+        if arrow is not None:
+            arrow.remove()
+        self.edge_paths.pop(edge, None)
+
+    def _style_edge(self, edge):
+        arrow = self.edge_artists.get(edge)
+        if arrow is None:
+            return
+        is_hovered = edge == self.hovered_edge
+        arrow.set_color('#FFD700' if is_hovered else '#aaaaaa')
+        arrow.set_linewidth(3.0 if is_hovered else 2.0)
+
+    def _update_selection_artist(self):
+        if self.selection_artist is not None:
+            self.selection_artist.remove()
+            self.selection_artist = None
+        if self.selected_node and self.selected_node in self.node_positions:
+            self.selection_artist = nx.draw_networkx_nodes(self.G, self.node_positions, nodelist=[self.selected_node], ax=self.ax, node_size=2600, node_color='none', edgecolors='#FFD700', linewidths=3)
+            self.selection_artist.set_zorder(3)
+
+    def _set_hovered_edge(self, edge):
+        previous = self.hovered_edge
+        self.hovered_edge = edge
+        self._style_edge(previous)
+        self._style_edge(edge)
+        self.draw_idle()
 
     def on_hover(self, event):
         if not event.inaxes or not self.node_positions or not self.G.edges():
             if self.hovered_edge:
-                self.hovered_edge = None; self.redraw_graph(); QToolTip.hideText()
+                self._set_hovered_edge(None); QToolTip.hideText()
             return
 
         x, y = event.xdata, event.ydata
@@ -378,11 +501,10 @@ class StoryGraph(FigureCanvas):
                 hovered_edge = edge
 
         if hovered_edge != self.hovered_edge:
-            self.hovered_edge = hovered_edge
-            self.redraw_graph()
+            self._set_hovered_edge(hovered_edge)
 
             if hovered_edge:
-                QToolTip.showText(QCursor.pos(), self.edge_labels.get(hovered_edge, ""), self)
+                QToolTip.showText(QCursor.pos(), self.document.edges.get(hovered_edge, ""), self)
             else:
                 QToolTip.hideText()
 
@@ -401,18 +523,19 @@ class StoryGraph(FigureCanvas):
 
         if min_dist_sq < 0.5:
             if self.selected_node == clicked_node:
-                scene = next((s for s in self.story_data['scenes'] if s['scene_id'] == clicked_node), None)
-                if scene:
-                    dialog = SceneDetailDialog(scene, parent=self)
+                if clicked_node in self.document:
+                    dialog = SceneDetailDialog(clicked_node, self.document.scene_text(clicked_node), parent=self)
                     dialog.exec_()
             else:
                 self.selected_node = clicked_node
         else:
             self.selected_node = None
 
-        self.redraw_graph()
+        self._update_selection_artist()
+        self.draw_idle()
+        self.selectionChanged.emit(self.selected_node)
 
     def get_graph_statistics(self):
         if not self.G.nodes(): return "Статистика недоступна."
-        num_endings = len([n for n, d in self.G.out_degree() if d == 0])
+        num_endings = len(self.document.endings)
         return f"Сцен: {self.G.number_of_nodes()} | Концовок: {num_endings} | Переходов: {self.G.number_of_edges()}"
\ No newline at end of file
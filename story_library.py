@@ -0,0 +1,180 @@
+import zlib
+from array import array
+from collections import OrderedDict
+
+from story_document import MISSING, StoryDocument, Scene, Choice
+
+_MISSING = 2
+_NO_CHOICES = 4
+
+
+class ChoiceTextPool:
+    def __init__(self):
+        self.texts = []
+        self.ids = {}
+
+    def intern(self, text):
+        text_id = self.ids.get(text)
+        if text_id is None:
+            text_id = len(self.texts)
+            self.texts.append(text)
+            self.ids[text] = text_id
+        return text_id
+
+    def __getitem__(self, text_id):
+        return self.texts[text_id]
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class CompactStory:
+    __slots__ = ('title', 'description', 'start_scene', 'scene_ids', 'arena', 'compressed',
+                 'text_offsets', 'choice_offsets', 'choice_text_ids', 'choice_targets',
+                 'dangling_targets', 'ending_flags', 'missing_text', 'extras', '_index')
+
+    def __init__(self, document, pool, compress=False):
+        self.title = document.title
+        self.description = document.description
+        self.start_scene = document.start_scene
+
+        ids = document.scene_ids()
+        self.scene_ids = None if ids == [str(i + 1) for i in range(len(ids))] else tuple(ids)
+        index = {scene_id: i for i, scene_id in enumerate(ids)}
+
+        arena = bytearray()
+        self.text_offsets = array('I', [0])
+        self.choice_offsets = array('I', [0])
+        self.choice_text_ids = array('I')
+        self.choice_targets = array('i')
+        self.dangling_targets = []
+        self.ending_flags = bytearray()
+        self.extras = None
+        self._index = None
+        missing_text = set()
+
+        for i, scene in enumerate(document.scenes):
+            if scene.text is None:
+                missing_text.add(i)
+            else:
+                arena += scene.text.encode('utf-8')
+            self.text_offsets.append(len(arena))
+
+            for j, choice in enumerate(scene.choices):
+                self.choice_text_ids.append(pool.intern(choice.text))
+                target = index.get(choice.next_scene)
+                if target is None:
+                    self.dangling_targets.append(choice.next_scene)
+                    target = -len(self.dangling_targets)
+                self.choice_targets.append(target)
+                if choice.extra:
+                    self._set_extra(('choice', i, j), choice.extra)
+            self.choice_offsets.append(len(self.choice_text_ids))
+
+            flag = _MISSING if scene.is_ending is None else int(scene.is_ending)
+            self.ending_flags.append(flag | _NO_CHOICES if scene.choices is MISSING else flag)
+            if scene.extra:
+                self._set_extra(('scene', i), scene.extra)
+
+        if document.extra:
+            self._set_extra(('story',), document.extra)
+        self.missing_text = frozenset(missing_text) if missing_text else None
+
+        self.compressed = compress
+        self.arena = zlib.compress(bytes(arena)) if compress else bytes(arena)
+
+    def _set_extra(self, key, value):
+        if self.extras is None:
+            self.extras = {}
+        self.extras[key] = value
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    def scene_id(self, i):
+        return self.scene_ids[i] if self.scene_ids is not None else str(i + 1)
+
+    def scene_index(self, scene_id):
+        if self.scene_ids is None:
+            i = int(scene_id) - 1 if scene_id.isdigit() else -1
+            return i if 0 <= i < len(self) and self.scene_id(i) == scene_id else None
+        if self._index is None:
+            self._index = {scene_id: i for i, scene_id in enumerate(self.scene_ids)}
+        return self._index.get(scene_id)
+
+    def decoded_arena(self):
+        return zlib.decompress(self.arena) if self.compressed else self.arena
+
+    def scene_text(self, i, arena=None):
+        if self.missing_text and i in self.missing_text:
+            return None
+        arena = arena if arena is not None else self.decoded_arena()
+        return arena[self.text_offsets[i]:self.text_offsets[i + 1]].decode('utf-8')
+
+    def target_id(self, k):
+        target = self.choice_targets[k]
+        return self.dangling_targets[-target - 1] if target < 0 else self.scene_id(target)
+
+    def _extra(self, *key):
+        return self.extras.get(key) if self.extras else None
+
+    def to_document(self, pool, text_provider=None, arena=None):
+        scenes = []
+        for i in range(len(self)):
+            flag = self.ending_flags[i]
+            if flag & _NO_CHOICES:
+                choices = MISSING
+            else:
+                choices = [Choice(pool[self.choice_text_ids[k]], self.target_id(k),
+                                  self._extra('choice', i, k - self.choice_offsets[i]))
+                           for k in range(self.choice_offsets[i], self.choice_offsets[i + 1])]
+            flag &= ~_NO_CHOICES
+            text = self.scene_text(i, arena) if arena is not None else None
+            scenes.append(Scene(self.scene_id(i), text, choices,
+                                None if flag == _MISSING else bool(flag), self._extra('scene', i)))
+        return StoryDocument(self.title, self.description, self.start_scene, scenes,
+                             self._extra('story'), text_provider)
+
+
+class StoryLibrary:
+    def __init__(self, compress=False, cache_size=8):
+        self.compress = compress
+        self.cache_size = cache_size
+        self.pool = ChoiceTextPool()
+        self.stories = []
+        self._arena_cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.stories)
+
+    def add(self, story):
+        document = story if isinstance(story, StoryDocument) else StoryDocument.from_dict(story)
+        self.stories.append(CompactStory(document, self.pool, self.compress))
+        return len(self.stories) - 1
+
+    def _arena(self, story_id):
+        story = self.stories[story_id]
+        if not story.compressed:
+            return story.arena
+        arena = self._arena_cache.pop(story_id, None)
+        if arena is None:
+            arena = story.decoded_arena()
+        self._arena_cache[story_id] = arena
+        while len(self._arena_cache) > self.cache_size:
+            self._arena_cache.popitem(last=False)
+        return arena
+
+    def scene_text(self, story_id, scene_id):
+        story = self.stories[story_id]
+        i = story.scene_index(scene_id)
+        if i is None:
+            return None
+        return story.scene_text(i, self._arena(story_id))
+
+    def get_document(self, story_id):
+        story = self.stories[story_id]
+        return story.to_document(self.pool, lambda scene_id: self.scene_text(story_id, scene_id))
+
+    def to_dict(self, story_id):
+        story = self.stories[story_id]
+        return story.to_document(self.pool, arena=self._arena(story_id)).to_dict()
@@ -0,0 +1,144 @@
+import json
+import mmap
+import re
+
+_MIN_LAZY_LENGTH = 64
+_LAZY_STRING = re.compile(rb'"(?:text|description)"[ \t\n\r]*:[ \t\n\r]*("[^"\\]{%d})' % _MIN_LAZY_LENGTH)
+_LAZY_KEYS = ('text', 'description')
+
+
+class StoryFile:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Файл истории пуст.")
+        self.header = {}
+        self.text_spans = {}
+        self._string_spans = []
+        self._scenes = []
+        try:
+            self._build_index()
+        except (ValueError, TypeError, AttributeError):
+            self.close()
+            raise ValueError("Некорректная структура JSON в файле истории.")
+
+    def _string_end(self, start):
+        mm = self._mm
+        end = mm.find(b'"', start)
+        while end > 0 and mm[end - 1] == 0x5c:
+            backslash = end - 1
+            while mm[backslash - 1] == 0x5c:
+                backslash -= 1
+            if (end - backslash) % 2 == 0:
+                break
+            end = mm.find(b'"', end + 1)
+        if end < 0:
+            raise ValueError(start)
+        return end + 1
+
+    def _build_index(self):
+        mm = self._mm
+        spans = self._string_spans
+        search = _LAZY_STRING.search
+        find = mm.find
+        pieces = []
+        position = 0
+        while True:
+            match = search(mm, position)
+            if match is None:
+                break
+            start = match.start(1)
+            end = find(b'"', match.end())
+            if end < 0 or mm[end - 1] == 0x5c:
+                end = self._string_end(match.end())
+            else:
+                end += 1
+            pieces.append(mm[position:start])
+            pieces.append(b'%d' % len(spans))
+            spans.append((start, end))
+            position = end
+        pieces.append(mm[position:])
+        data = json.loads(b''.join(pieces))
+        del pieces
+
+        resolved = 0
+        for key in _LAZY_KEYS:
+            if type(data.get(key)) is int:
+                data[key] = self._string(data[key])
+                resolved += 1
+        scenes = data.get('scenes', [])
+        for scene in scenes:
+            for key in _LAZY_KEYS:
+                if type(scene.get(key)) is int:
+                    resolved += 1
+        if resolved < len(spans):
+            for scene in scenes:
+                for key, value in scene.items():
+                    if key not in _LAZY_KEYS:
+                        self._resolve(value)
+
+        self.header = {key: data[key] for key in ('title', 'description', 'start_scene') if key in data}
+        self._scenes = list(scenes)
+
+    def _string(self, string_id):
+        start, end = self._string_spans[string_id]
+        return json.loads(self._mm[start:end])
+
+    def _resolve(self, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in _LAZY_KEYS and type(item) is int:
+                    value[key] = self._string(item)
+                else:
+                    self._resolve(item)
+        elif isinstance(value, list):
+            for item in value:
+                self._resolve(item)
+
+    def load_structure(self):
+        scenes = []
+        for i, scene in enumerate(self._scenes):
+            scene_id = str(scene.get('scene_id', i + 1))
+            scene['scene_id'] = scene_id
+            text = scene.pop('text') if 'text' in scene else scene.get('description')
+            scene.pop('description', None)
+            scene.setdefault('choices', [])
+            scene.setdefault('is_ending', not scene['choices'])
+            self.text_spans[scene_id] = text
+            scenes.append(scene)
+
+        return {
+            'title': self.header.get('title', ''),
+            'description': self.header.get('description', ''),
+            'start_scene': self.header.get('start_scene', scenes[0]['scene_id'] if scenes else '1'),
+            'scenes': scenes
+        }
+
+    def scene_text(self, scene_id):
+        text = self.text_spans.get(scene_id)
+        if type(text) is int:
+            return self._string(text)
+        return text if text is not None else 'Описание отсутствует.'
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+def open_story(path):
+    story_file = StoryFile(path)
+    try:
+        story_data = story_file.load_structure()
+    except Exception:
+        story_file.close()
+        raise
+    if not story_data['scenes']:
+        story_file.close()
+        raise ValueError("В файле истории нет сцен.")
+    return story_file, story_data
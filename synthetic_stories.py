@@ -0,0 +1,140 @@
+import argparse
+import json
+import random
+
+WORDS = [
+    'древний', 'замок', 'тёмный', 'лес', 'герой', 'меч', 'магия', 'тропа', 'дракон', 'деревня',
+    'культист', 'артефакт', 'руины', 'пещера', 'король', 'страж', 'туман', 'огонь', 'река', 'мост',
+    'осколок', 'храм', 'тень', 'ветер', 'клятва', 'предатель', 'союзник', 'сундук', 'ловушка', 'портал',
+    'шёпот', 'камень', 'свиток', 'золото', 'кровь', 'луна', 'башня', 'подземелье', 'зелье', 'проклятие'
+]
+
+CHOICE_TEXTS = [
+    'Вернуться', 'Открыть сундук', 'Идти дальше', 'Осмотреться', 'Сразиться', 'Убежать',
+    'Поговорить со стражем', 'Спуститься в пещеру', 'Перейти мост', 'Прочитать свиток',
+    'Довериться союзнику', 'Спрятаться в тени', 'Выпить зелье', 'Войти в портал', 'Отдохнуть у костра'
+]
+
+MALFORMED_VARIANTS = ('fenced', 'missing_commas', 'prose', 'dangling', 'missing_text', 'truncated')
+
+
+def _scene_text(rng, text_words):
+    count = rng.randint(*text_words)
+    words = rng.choices(WORDS, k=count)
+    sentences = []
+    for i in range(0, count, 12):
+        sentence = ' '.join(words[i:i + 12])
+        sentences.append(sentence[:1].upper() + sentence[1:] + '.')
+    return ' '.join(sentences)
+
+
+def generate_story(num_scenes=12, branching=2, cycle_rate=0.0, cross_rate=0.1, islands=0,
+                   text_words=(80, 150), seed=0):
+    if num_scenes < 1:
+        raise ValueError("Количество сцен должно быть положительным.")
+    if branching < 1:
+        raise ValueError("Коэффициент ветвления должен быть не меньше 1.")
+    rng = random.Random(seed)
+
+    islands = min(islands, num_scenes - 1)
+    main_count = num_scenes - islands
+    targets = {i: [] for i in range(1, num_scenes + 1)}
+
+    for child in range(2, main_count + 1):
+        targets[(child - 2) // branching + 1].append(child)
+
+    for scene_id in range(1, main_count + 1):
+        if not targets[scene_id]:
+            continue
+        if rng.random() < cross_rate and scene_id + 1 < main_count:
+            targets[scene_id].append(rng.randint(scene_id + 1, main_count))
+        if rng.random() < cycle_rate and scene_id > 1:
+            targets[scene_id].append(rng.randint(1, scene_id - 1))
+
+    for scene_id in range(main_count + 1, num_scenes):
+        targets[scene_id].append(scene_id + 1)
+
+    scenes = []
+    for scene_id in range(1, num_scenes + 1):
+        choices = [{'text': rng.choice(CHOICE_TEXTS), 'next_scene': str(t)} for t in targets[scene_id]]
+        scenes.append({
+            'scene_id': str(scene_id),
+            'text': _scene_text(rng, text_words),
+            'choices': choices,
+            'is_ending': not choices
+        })
+
+    description = _scene_text(rng, (30, 60))
+    title = description[:50] + ('...' if len(description) > 50 else '')
+    return {
+        'title': title,
+        'description': description,
+        'start_scene': '1',
+        'scenes': scenes
+    }
+
+
+def generate_ai_response(story, variant=None, seed=0):
+    rng = random.Random(seed)
+    scene_list = [{'scene_id': s['scene_id'], 'text': s['text'], 'choices': [dict(c) for c in s['choices']]}
+                  for s in story['scenes']]
+
+    if variant == 'dangling':
+        for scene in scene_list:
+            for choice in scene['choices']:
+                if rng.random() < 0.1:
+                    choice['next_scene'] = str(len(scene_list) + rng.randint(1, 100))
+    elif variant == 'missing_text':
+        for scene in scene_list:
+            if rng.random() < 0.2:
+                scene['description'] = scene.pop('text')
+
+    objects = [json.dumps(scene, ensure_ascii=False) for scene in scene_list]
+    separator = '\n' if variant == 'missing_commas' else ',\n'
+    raw = '[' + separator.join(objects) + ']'
+
+    if variant == 'fenced':
+        raw = f"```json\n{raw}\n```"
+    elif variant == 'prose':
+        raw = f"Вот ваш квест:\n{raw}\nНадеюсь, он вам понравится!"
+    elif variant == 'truncated':
+        raw = raw[:max(1, int(len(raw) * 0.7))]
+    elif variant is not None and variant not in MALFORMED_VARIANTS:
+        raise ValueError(f"Неизвестный вариант повреждения: {variant}")
+    return raw
+
+
+def generate_corpus(count, num_scenes=12, branching=2, seed=0, **kwargs):
+    return [generate_story(num_scenes=num_scenes, branching=branching, seed=seed + i, **kwargs)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетических историй")
+    parser.add_argument('--scenes', type=int, default=12)
+    parser.add_argument('--branching', type=int, default=2)
+    parser.add_argument('--cycle-rate', type=float, default=0.0)
+    parser.add_argument('--cross-rate', type=float, default=0.1)
+    parser.add_argument('--islands', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--raw', choices=MALFORMED_VARIANTS + ('clean',),
+                        help="вывести сырой ответ AI вместо готовой истории")
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+
+    story = generate_story(args.scenes, args.branching, args.cycle_rate, args.cross_rate,
+                           args.islands, seed=args.seed)
+    if args.raw:
+        text = generate_ai_response(story, None if args.raw == 'clean' else args.raw, seed=args.seed)
+    else:
+        text = json.dumps(story, ensure_ascii=False, indent=2)
+
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+from config import TIMING_ENABLED, TIMING_LOG
+
+ENABLED = TIMING_ENABLED
+
+SPAN_LABELS = {
+    'http.connect': 'соединение',
+    'http.first_byte': 'первый байт',
+    'http.complete': 'сеть',
+    'parse': 'разбор',
+    'convert': 'конвертация',
+    'dedup': 'поиск дубликатов',
+    'graph_build': 'граф',
+    'layout': 'раскладка',
+    'draw': 'отрисовка'
+}
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_local = threading.local()
+_run = None
+last_summary = ''
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+def span(name):
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+def mute():
+    _local.muted = True
+
+def record(name, seconds):
+    if not ENABLED or getattr(_local, 'muted', False):
+        return
+    with _lock:
+        if _run is not None:
+            _run['spans'][name] = _run['spans'].get(name, 0.0) + seconds
+
+def count(name, value=1):
+    if not ENABLED or getattr(_local, 'muted', False):
+        return
+    with _lock:
+        if _run is not None:
+            _run['counters'][name] = _run['counters'].get(name, 0) + value
+
+def begin(label):
+    global _run
+    if not ENABLED:
+        return
+    with _lock:
+        _run = {'label': label, 'timestamp': time.time(), 'spans': {}, 'counters': {}}
+
+def end():
+    global _run, last_summary
+    if not ENABLED:
+        return ''
+    with _lock:
+        run, _run = _run, None
+    if run is None:
+        return ''
+
+    last_summary = summarize(run)
+    if TIMING_LOG:
+        entry = {
+            'label': run['label'],
+            'timestamp': run['timestamp'],
+            'spans_ms': {name: round(seconds * 1000, 3) for name, seconds in run['spans'].items()},
+            'counters': run['counters']
+        }
+        try:
+            with open(TIMING_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError:
+            pass
+    return last_summary
+
+def _format_seconds(seconds):
+    return f"{seconds:.2f}с" if seconds >= 1 else f"{seconds * 1000:.0f}мс"
+
+def summarize(run):
+    parts = [f"{label} {_format_seconds(run['spans'][name])}"
+             for name, label in SPAN_LABELS.items() if name in run['spans']]
+    counters = run['counters']
+    if 'tokens' in counters:
+        parts.append(f"токенов {counters['tokens']}")
+    if counters.get('repairs'):
+        parts.append(f"исправлений {counters['repairs']}")
+    return ' · '.join(parts)